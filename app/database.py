@@ -1,18 +1,251 @@
 import os
 import sqlite3
+import threading
 import time
 import uuid
 import secrets
+import itertools
+import json
+import logging
+from datetime import datetime, timedelta, timezone
+
+from . import log, metrics
 
 _DB_PATH = os.environ.get("HYST_DB_PATH", os.path.join(os.path.dirname(os.path.dirname(__file__)), "app.db"))
 
+# connection tuning, see https://www.sqlite.org/pragma.html
+_DB_SYNCHRONOUS  = os.environ.get("HYST_DB_SYNCHRONOUS", "NORMAL")
+_DB_MMAP_SIZE    = int(os.environ.get("HYST_DB_MMAP_SIZE", str(256 * 1024 * 1024)))
+_DB_CACHE_SIZE   = int(os.environ.get("HYST_DB_CACHE_SIZE", "-65536"))  # negative = KiB
+_DB_BUSY_TIMEOUT = float(os.environ.get("HYST_DB_BUSY_TIMEOUT", "5"))
+_DB_STATEMENTS   = int(os.environ.get("HYST_DB_STATEMENT_CACHE", "256"))
+
+# seconds a cached user/config entry is trusted before it is re-read, so that
+# edits made by another process (e.g. the cli) are eventually picked up
+_CACHE_TTL = float(os.environ.get("HYST_CACHE_TTL", "60"))
+
+_local = threading.local()
+
+
+def _timed(fn):
+    """Records the function's duration in hyst_db_seconds{function=...}."""
+    return metrics.db_seconds.time(fn.__name__)(fn)
+
 
 def get_db() -> sqlite3.Connection:
-    conn = sqlite3.connect(_DB_PATH)
-    conn.row_factory = sqlite3.Row
+    """
+    Returns this thread's connection, opening and tuning it on first use.
+    Connections live as long as their thread and must not be closed by callers;
+    writers wrap their statements in `with conn:` so a failure never leaves a
+    transaction open on the shared connection.
+    """
+    conn = getattr(_local, "conn", None)
+    if conn is None or _local.path != _DB_PATH:
+        conn = sqlite3.connect(_DB_PATH, timeout=_DB_BUSY_TIMEOUT, cached_statements=_DB_STATEMENTS)
+        conn.row_factory = sqlite3.Row
+        conn.execute("PRAGMA journal_mode = WAL")
+        conn.execute(f"PRAGMA synchronous = {_DB_SYNCHRONOUS}")
+        conn.execute(f"PRAGMA mmap_size = {_DB_MMAP_SIZE}")
+        conn.execute(f"PRAGMA cache_size = {_DB_CACHE_SIZE}")
+        _local.conn, _local.path = conn, _DB_PATH
     return conn
 
 
+# ── change tracking ───────────────────────────────────────────────────────────
+
+# bumped by every user/host/config write; derived caches (e.g. rendered
+# subscriptions) remember the generation they were built at
+_generation_counter = itertools.count(1)
+_generation = 0
+
+
+def generation() -> int:
+    return _generation
+
+
+def _bump_generation() -> None:
+    global _generation
+    _generation = next(_generation_counter)
+
+
+# other processes (uvicorn workers, the cli, the internal app) learn about
+# user/host/config writes and stored traffic through the changes table: writers
+# append a row in the same transaction, and every server process applies new
+# rows to its own caches with sync_changes()
+_CHANGES_RETENTION = 3600
+_last_change_id: int | None = None
+
+
+def _log_change(cur: sqlite3.Cursor, kind: str, key: str | None, version: int | None = None) -> None:
+    cur.execute(
+        "INSERT INTO changes (ts, kind, key, version) VALUES (?, ?, ?, ?)",
+        (int(time.time()), kind, key, version),
+    )
+
+
+def sync_changes() -> int:
+    """
+    Invalidates this process's caches for every change logged since the last
+    call (the first call only records where the log stands). Returns the
+    number of changes applied.
+    """
+    global _last_change_id
+    conn = get_db()
+    cur  = conn.cursor()
+    if _last_change_id is None:
+        _last_change_id = cur.execute("SELECT COALESCE(MAX(id), 0) FROM changes").fetchone()[0]
+        return 0
+    cur.execute("SELECT id, kind, key FROM changes WHERE id > ? ORDER BY id", (_last_change_id,))
+    rows = cur.fetchall()
+    for r in rows:
+        if r["kind"] == "user":
+            invalidate_auth_cache(r["key"])
+        elif r["kind"] == "config":
+            _invalidate_config_cache()
+    if any(r["kind"] == "traffic" for r in rows):
+        _refresh_cached_totals(cur)
+    if any(r["kind"] != "traffic" for r in rows):
+        # traffic alone changes no user/host/config data derived caches depend on
+        _bump_generation()
+    if rows:
+        _last_change_id = rows[-1]["id"]
+    return len(rows)
+
+
+def _refresh_cached_totals(cur: sqlite3.Cursor) -> None:
+    """Re-reads the all-time total of every user in the auth cache."""
+    names = list(_auth_cache)
+    for i in range(0, len(names), 500):
+        chunk = names[i:i + 500]
+        cur.execute(
+            f"SELECT username, tx + rx AS total FROM user_traffic_totals WHERE username IN ({','.join('?' * len(chunk))})",
+            chunk,
+        )
+        totals = {r["username"]: r["total"] for r in cur.fetchall()}
+        with _auth_cache_lock:
+            for name in chunk:
+                entry = _auth_cache.get(name)
+                if entry is not None:
+                    entry["total"] = totals.get(name, 0)
+
+
+def list_changes(after: int = 0, limit: int = 1000) -> list:
+    """
+    The change feed: up to `limit` changes with id > `after`, oldest first.
+    Rows carry kind, key and, for user/host edits, the row's new version; a
+    NULL key means "anything of this kind". Only the last hour is kept.
+    """
+    conn = get_db()
+    cur  = conn.cursor()
+    cur.execute("SELECT id, ts, kind, key, version FROM changes WHERE id > ? ORDER BY id LIMIT ?", (after, limit))
+    return cur.fetchall()
+
+
+def prune_changes() -> int:
+    conn = get_db()
+    with conn:
+        cur = conn.cursor()
+        cur.execute("DELETE FROM changes WHERE ts < ?", (int(time.time()) - _CHANGES_RETENTION,))
+    return cur.rowcount
+
+
+# ── leases ────────────────────────────────────────────────────────────────────
+
+def acquire_lease(name: str, holder: str, ttl: float) -> bool:
+    """
+    Takes or renews the named lease for `ttl` seconds. Succeeds if it is free,
+    expired, or already held by `holder`; one statement, so it is atomic across
+    processes.
+    """
+    now  = time.time()
+    conn = get_db()
+    with conn:
+        cur = conn.cursor()
+        cur.execute("""
+            INSERT INTO leases (name, holder, expires_at) VALUES (?, ?, ?)
+            ON CONFLICT (name) DO UPDATE SET holder = excluded.holder, expires_at = excluded.expires_at
+            WHERE leases.holder = excluded.holder OR leases.expires_at < ?
+        """, (name, holder, now + ttl, now))
+    return cur.rowcount == 1
+
+
+def release_lease(name: str, holder: str) -> None:
+    conn = get_db()
+    with conn:
+        conn.execute("DELETE FROM leases WHERE name = ? AND holder = ?", (name, holder))
+
+
+# ts is a unix epoch; span is the bucket width of rolled-up rows (0 = raw)
+_TRAFFIC_DDL = """
+    CREATE TABLE IF NOT EXISTS {table} (
+        id       INTEGER PRIMARY KEY AUTOINCREMENT,
+        ts       INTEGER NOT NULL,
+        server   TEXT    NOT NULL,
+        username TEXT    NOT NULL,
+        tx       INTEGER NOT NULL,
+        rx       INTEGER NOT NULL,
+        span     INTEGER NOT NULL DEFAULT 0
+    )
+"""
+
+
+def _migrate_traffic_ts(conn: sqlite3.Connection, batch: int = 50_000, swap: bool = True) -> int:
+    """
+    Rewrites a legacy traffic table (ISO-8601 TEXT ts) into traffic_v2 with epoch ts.
+    Rows are copied in id order, one batch per transaction, and an interrupted
+    run resumes where it stopped. With `swap` the final catch-up and table swap
+    then share one short transaction. Returns the number of rows copied.
+
+    This is an offline migration: init_db runs it before any server starts, so
+    the panel (including /auth) is down while it copies. To shorten that, run
+    `run.py migrate` (swap=False) while the previous version is still serving;
+    its writers only ever wait for a single batch, and the restart then only
+    copies the rows written since.
+    """
+    cur = conn.cursor()
+    cur.execute(_TRAFFIC_DDL.format(table="traffic_v2"))
+    cur.execute("CREATE INDEX IF NOT EXISTS traffic_time    ON traffic_v2 (ts)")
+    cur.execute("CREATE INDEX IF NOT EXISTS traffic_user_ts ON traffic_v2 (username, ts, tx, rx)")
+    conn.commit()
+    legacy = {r[1] for r in cur.execute("PRAGMA table_info(traffic)").fetchall()}
+    copy = f"""
+        INSERT INTO traffic_v2 (id, ts, server, username, tx, rx, span)
+        SELECT id, CAST(strftime('%s', ts) AS INTEGER), server, username, tx, rx, {'span' if 'span' in legacy else '0'}
+        FROM traffic
+        WHERE id > (SELECT COALESCE(MAX(id), 0) FROM traffic_v2)
+        ORDER BY id
+    """
+    total = 0
+    while True:
+        cur.execute(f"{copy} LIMIT ?", (batch,))
+        copied = cur.rowcount
+        conn.commit()
+        total += copied
+        if copied < batch:
+            break
+    if swap:
+        with conn:
+            cur.execute("BEGIN IMMEDIATE")
+            cur.execute(copy)
+            total += cur.rowcount
+            cur.execute("DROP TABLE traffic")
+            cur.execute("ALTER TABLE traffic_v2 RENAME TO traffic")
+    return total
+
+
+def precopy_traffic_ts() -> int | None:
+    """
+    Copies a legacy traffic table into traffic_v2 without swapping it in, see
+    _migrate_traffic_ts. Returns the rows copied, or None if there is nothing
+    to migrate. Touches no other table, so it is safe next to an older version.
+    """
+    conn = get_db()
+    cols = {r[1]: r[2] for r in conn.execute("PRAGMA table_info(traffic)").fetchall()}
+    if cols.get("ts", "").upper() != "TEXT":
+        return None
+    return _migrate_traffic_ts(conn, swap=False)
+
+
 def init_db():
     conn = get_db()
     cur  = conn.cursor()
@@ -23,25 +256,63 @@ def init_db():
             sid           TEXT    UNIQUE NOT NULL,
             active        INTEGER NOT NULL DEFAULT 1,
             traffic_limit INTEGER NOT NULL DEFAULT 0,
-            expires_at    INTEGER NOT NULL DEFAULT 0
+            expires_at    INTEGER NOT NULL DEFAULT 0,
+            version       INTEGER NOT NULL DEFAULT 1
         )
     """)
     cols = {r[1] for r in cur.execute("PRAGMA table_info(users)").fetchall()}
-    for col, default in [("active", "1"), ("traffic_limit", "0"), ("expires_at", "0")]:
+    for col, default in [("active", "1"), ("traffic_limit", "0"), ("expires_at", "0"), ("version", "1")]:
         if col not in cols:
             cur.execute(f"ALTER TABLE users ADD COLUMN {col} INTEGER NOT NULL DEFAULT {default}")
+    cur.execute(_TRAFFIC_DDL.format(table="traffic"))
+    cols = {r[1]: r[2] for r in cur.execute("PRAGMA table_info(traffic)").fetchall()}
+    if "span" not in cols:
+        cur.execute("ALTER TABLE traffic ADD COLUMN span INTEGER NOT NULL DEFAULT 0")
+    if cols["ts"].upper() == "TEXT":
+        conn.commit()
+        log.event("traffic_migration_started", logging.WARNING, note="blocks startup until done, see run.py migrate")
+        log.event("traffic_migration_done", logging.WARNING, rows=_migrate_traffic_ts(conn))
+    cur.execute("CREATE INDEX IF NOT EXISTS traffic_time    ON traffic (ts)")
+    cur.execute("CREATE INDEX IF NOT EXISTS traffic_user_ts ON traffic (username, ts, tx, rx)")
+    has_totals = cur.execute(
+        "SELECT 1 FROM sqlite_master WHERE type = 'table' AND name = 'user_traffic_totals'"
+    ).fetchone() is not None
+    cur.execute("""
+        CREATE TABLE IF NOT EXISTS user_traffic_totals (
+            username TEXT    PRIMARY KEY,
+            tx       INTEGER NOT NULL DEFAULT 0,
+            rx       INTEGER NOT NULL DEFAULT 0
+        )
+    """)
+    if not has_totals:
+        _rebuild_traffic_totals(cur)
+    cur.execute("CREATE INDEX IF NOT EXISTS user_traffic_totals_total ON user_traffic_totals (tx + rx, username)")
+    cur.execute("""
+        CREATE TABLE IF NOT EXISTS poll_journal (
+            id      INTEGER PRIMARY KEY AUTOINCREMENT,
+            host    TEXT    NOT NULL,
+            ts      INTEGER NOT NULL,
+            state   TEXT    NOT NULL DEFAULT 'pending',
+            payload TEXT
+        )
+    """)
     cur.execute("""
-        CREATE TABLE IF NOT EXISTS traffic (
-            id       INTEGER PRIMARY KEY AUTOINCREMENT,
-            ts       TEXT    NOT NULL,
-            server   TEXT    NOT NULL,
-            username TEXT    NOT NULL,
-            tx       INTEGER NOT NULL,
-            rx       INTEGER NOT NULL
+        CREATE TABLE IF NOT EXISTS changes (
+            id   INTEGER PRIMARY KEY AUTOINCREMENT,
+            ts   INTEGER NOT NULL,
+            kind TEXT    NOT NULL,
+            key  TEXT
+        )
+    """)
+    if "version" not in {r[1] for r in cur.execute("PRAGMA table_info(changes)").fetchall()}:
+        cur.execute("ALTER TABLE changes ADD COLUMN version INTEGER")
+    cur.execute("""
+        CREATE TABLE IF NOT EXISTS leases (
+            name       TEXT PRIMARY KEY,
+            holder     TEXT NOT NULL,
+            expires_at REAL NOT NULL
         )
     """)
-    cur.execute("CREATE INDEX IF NOT EXISTS traffic_ts   ON traffic (ts)")
-    cur.execute("CREATE INDEX IF NOT EXISTS traffic_user ON traffic (username)")
     cur.execute("""
         CREATE TABLE IF NOT EXISTS hosts (
             address     TEXT PRIMARY KEY,
@@ -49,9 +320,12 @@ def init_db():
             port        INTEGER NOT NULL DEFAULT 443,
             api_address TEXT NOT NULL,
             api_secret  TEXT NOT NULL,
-            active      INTEGER NOT NULL DEFAULT 1
+            active      INTEGER NOT NULL DEFAULT 1,
+            version     INTEGER NOT NULL DEFAULT 1
         )
     """)
+    if "version" not in {r[1] for r in cur.execute("PRAGMA table_info(hosts)").fetchall()}:
+        cur.execute("ALTER TABLE hosts ADD COLUMN version INTEGER NOT NULL DEFAULT 1")
     cur.execute("""
         CREATE TABLE IF NOT EXISTS config (
             key   TEXT PRIMARY KEY,
@@ -60,84 +334,202 @@ def init_db():
     """)
     defaults = {
         "poll_interval": "600",
+        "poll_concurrency": "8",
+        "poll_host_timeout": "30",
+        "poll_cycle_deadline": "120",
         "profile_name_tpl": "hysteria for {uname}",
         "forbidden_domains": "",
         "whitelist_enable": "false",
         "whitelist": "",
+        "enforce_enable": "false",
+        "poll_min_interval": "30",
+        "poll_target_bytes": str(1 << 30),
+        "poll_jitter": "0.1",
+        "rollup_interval": "3600",
+        "traffic_raw_retention_hours": "24",
+        "traffic_hourly_retention_days": "7",
+        "traffic_daily_retention_days": "90",
     }
     for k, v in defaults.items():
         cur.execute("INSERT OR IGNORE INTO config (key, value) VALUES (?, ?)", (k, v))
     conn.commit()
-    conn.close()
 
 
 # ── users ─────────────────────────────────────────────────────────────────────
 
+@_timed
 def user_exists(username: str) -> bool:
     conn = get_db()
     cur  = conn.cursor()
     cur.execute("SELECT 1 FROM users WHERE username = ?", (username,))
     exists = cur.fetchone() is not None
-    conn.close()
     return exists
 
 
+@_timed
 def get_user(username: str) -> sqlite3.Row | None:
     conn = get_db()
     cur  = conn.cursor()
     cur.execute("SELECT * FROM users WHERE username = ?", (username,))
     row = cur.fetchone()
-    conn.close()
     return row
 
 
+@_timed
+def get_user_by_sid(sid: str) -> sqlite3.Row | None:
+    conn = get_db()
+    cur  = conn.cursor()
+    cur.execute("SELECT * FROM users WHERE sid = ?", (sid,))
+    row = cur.fetchone()
+    return row
+
+
+@_timed
 def list_users() -> list:
     conn = get_db()
     cur  = conn.cursor()
     cur.execute("SELECT * FROM users ORDER BY username")
     rows = cur.fetchall()
-    conn.close()
     return rows
 
 
+_USERS_PAGE_SELECT = """
+    SELECT u.username, u.password, u.sid, u.active, u.traffic_limit, u.expires_at, u.version,
+           COALESCE(t.tx + t.rx, 0) AS total
+"""
+
+
+@_timed
+def list_users_page(
+    after: str | None = None,
+    limit: int = 100,
+    *,
+    sort: str = "username",
+    active: bool | None = None,
+    expired: bool | None = None,
+    over_limit: bool | None = None,
+    near_limit: float | None = None,
+) -> tuple[list[dict], str | None]:
+    """
+    One page of users with their all-time traffic as `total`, after the cursor
+    `after`. Returns (rows, next cursor or None on the last page). The cursor
+    is a username, or with sort="traffic" (total descending, then users without
+    traffic by name) the "total:username" last served, so pages stay in step
+    while totals move; a malformed one raises ValueError. Pages walk the users primary key or the user_traffic_totals_total
+    index, so an unfiltered page reads about `limit` rows; filters (near_limit
+    is a percentage of traffic_limit) are checked along the way.
+    """
+    where  = []
+    params = {"now": int(time.time()), "after": after, "limit": limit + 1, "near": near_limit}
+    if active is not None:
+        where.append(f"u.active = {int(active)}")
+    if expired is not None:
+        where.append(("" if expired else "NOT ") + "(u.expires_at > 0 AND u.expires_at <= :now)")
+    if over_limit is not None:
+        where.append(("" if over_limit else "NOT ") + "(u.traffic_limit > 0 AND COALESCE(t.tx + t.rx, 0) >= u.traffic_limit)")
+    if near_limit is not None:
+        where.append("u.traffic_limit > 0 AND COALESCE(t.tx + t.rx, 0) * 100 >= u.traffic_limit * :near")
+    filters = "".join(f" AND {w}" for w in where)
+    conn    = get_db()
+    cur     = conn.cursor()
+
+    if sort != "traffic":
+        cur.execute(f"""
+            {_USERS_PAGE_SELECT}
+            FROM users u LEFT JOIN user_traffic_totals t ON t.username = u.username
+            WHERE u.username > COALESCE(:after, '') {filters}
+            ORDER BY u.username LIMIT :limit
+        """, params)
+        rows = [dict(r) for r in cur.fetchall()]
+    else:
+        params["total"] = 0
+        if after is not None:
+            total, sep, params["after"] = after.partition(":")
+            if not sep:
+                raise ValueError("expected total:username")
+            params["total"] = int(total)
+        rows = []
+        if after is None or params["total"] > 0:
+            cursor = "AND t.tx + t.rx <= :total AND (t.tx + t.rx, t.username) < (:total, :after)" if after is not None else ""
+            cur.execute(f"""
+                {_USERS_PAGE_SELECT}
+                FROM user_traffic_totals t JOIN users u ON u.username = t.username
+                WHERE t.tx + t.rx > 0 {cursor} {filters}
+                ORDER BY t.tx + t.rx DESC, t.username DESC LIMIT :limit
+            """, params)
+            rows = [dict(r) for r in cur.fetchall()]
+            params["after"] = None
+        if len(rows) <= limit:
+            params["limit"] = limit + 1 - len(rows)
+            cur.execute(f"""
+                {_USERS_PAGE_SELECT}
+                FROM users u LEFT JOIN user_traffic_totals t ON t.username = u.username
+                WHERE u.username > COALESCE(:after, '') AND COALESCE(t.tx + t.rx, 0) <= 0 {filters}
+                ORDER BY u.username LIMIT :limit
+            """, params)
+            rows += [dict(r) for r in cur.fetchall()]
+
+    if len(rows) > limit:
+        last = rows[limit - 1]
+        return rows[:limit], f"{last['total']}:{last['username']}" if sort == "traffic" else last["username"]
+    return rows, None
+
+
+@_timed
 def list_users_with_traffic() -> list[dict]:
     conn = get_db()
     cur  = conn.cursor()
     cur.execute("""
         SELECT u.username, u.password, u.sid, u.active,
-               u.traffic_limit, u.expires_at,
-               COALESCE(SUM(t.tx + t.rx), 0) AS total
+               u.traffic_limit, u.expires_at, u.version,
+               COALESCE(t.tx + t.rx, 0) AS total
         FROM users u
-        LEFT JOIN traffic t ON t.username = u.username
-        GROUP BY u.username
+        LEFT JOIN user_traffic_totals t ON t.username = u.username
         ORDER BY u.username
     """)
     rows = cur.fetchall()
-    conn.close()
     return [dict(r) for r in rows]
 
 
+@_timed
 def create_user(
     username: str,
     *,
     traffic_limit: int = 0,
     expires_at: int = 0,
 ) -> dict | None:
-    if user_exists(username):
-        return None
     password = str(uuid.uuid4())
     sid      = secrets.token_urlsafe(12)
     conn = get_db()
-    cur  = conn.cursor()
-    cur.execute(
-        "INSERT INTO users (username, password, sid, traffic_limit, expires_at) VALUES (?, ?, ?, ?, ?)",
-        (username, password, sid, traffic_limit, expires_at),
-    )
-    conn.commit()
-    conn.close()
-    return {"username": username, "password": password, "sid": sid, "traffic_limit": traffic_limit, "expires_at": expires_at}
+    with conn:
+        cur = conn.cursor()
+        cur.execute(
+            "INSERT INTO users (username, password, sid, traffic_limit, expires_at) VALUES (?, ?, ?, ?, ?)"
+            " ON CONFLICT (username) DO NOTHING",
+            (username, password, sid, traffic_limit, expires_at),
+        )
+        if cur.rowcount == 0:
+            return None
+        _log_change(cur, "user", username, 1)
+    invalidate_auth_cache(username)
+    _bump_generation()
+    return {"username": username, "password": password, "sid": sid, "traffic_limit": traffic_limit, "expires_at": expires_at, "version": 1}
+
+
+_EDIT_USER = """
+    UPDATE users SET
+        password      = COALESCE(?, password),
+        sid           = COALESCE(?, sid),
+        active        = COALESCE(?, active),
+        traffic_limit = COALESCE(?, traffic_limit),
+        expires_at    = COALESCE(?, expires_at),
+        version       = version + 1
+    WHERE username = ? AND (? IS NULL OR version = ?)
+    RETURNING *
+"""
 
 
+@_timed
 def edit_user(
     username: str,
     *,
@@ -146,135 +538,685 @@ def edit_user(
     active: bool | None = None,
     traffic_limit: int | None = None,
     expires_at: int | None = None,
-) -> bool:
-    if not user_exists(username):
-        return False
-    conn = get_db()
-    cur  = conn.cursor()
-    if password is not None:
-        cur.execute("UPDATE users SET password = ? WHERE username = ?", (password, username))
-    if sid is not None:
-        cur.execute("UPDATE users SET sid = ? WHERE username = ?", (sid, username))
-    if active is not None:
-        cur.execute("UPDATE users SET active = ? WHERE username = ?", (int(active), username))
-    if traffic_limit is not None:
-        cur.execute("UPDATE users SET traffic_limit = ? WHERE username = ?", (traffic_limit, username))
-    if expires_at is not None:
-        cur.execute("UPDATE users SET expires_at = ? WHERE username = ?", (expires_at, username))
-    conn.commit()
-    conn.close()
-    return True
+    if_version: int | None = None,
+) -> sqlite3.Row | None:
+    """
+    Applies the given fields in one statement and returns the updated row, or
+    None if the user does not exist or (with `if_version`) has moved past that
+    version. Every edit bumps the row's version; one with no fields changes
+    nothing and returns the current row.
+    """
+    fields = (password, sid, None if active is None else int(active), traffic_limit, expires_at)
+    conn   = get_db()
+    if all(f is None for f in fields):
+        return conn.execute(
+            "SELECT * FROM users WHERE username = ? AND (? IS NULL OR version = ?)", (username, if_version, if_version),
+        ).fetchone()
+    with conn:
+        cur = conn.cursor()
+        cur.execute(_EDIT_USER, (*fields, username, if_version, if_version))
+        row = cur.fetchone()
+        if row is None:
+            return None
+        _log_change(cur, "user", username, row["version"])
+    invalidate_auth_cache(username)
+    _bump_generation()
+    return row
 
 
+@_timed
 def delete_user(username: str) -> bool:
-    if not user_exists(username):
-        return False
     conn = get_db()
-    cur  = conn.cursor()
-    cur.execute("DELETE FROM users WHERE username = ?", (username,))
-    conn.commit()
-    conn.close()
+    with conn:
+        cur = conn.cursor()
+        cur.execute("DELETE FROM users WHERE username = ?", (username,))
+        if cur.rowcount == 0:
+            return False
+        _log_change(cur, "user", username)
+    invalidate_auth_cache(username)
+    _bump_generation()
     return True
 
 
-# ── auth ──────────────────────────────────────────────────────────────────────
+# bulk provisioning: rows are {line, op, username, password, sid, active,
+# traffic_limit, expires_at} with op "create", "update" or "deactivate" and
+# None for fields to leave alone (see app.utils.bulk for parsing)
+_BULK_BATCH = 1000
 
-def check_auth(username: str, password: str) -> tuple[bool, str]:
+_BULK_INSERT = "INSERT INTO users (username, password, sid, active, traffic_limit, expires_at) VALUES (?, ?, ?, ?, ?, ?)"
+_BULK_UPDATE = """
+    UPDATE users SET
+        password      = COALESCE(?, password),
+        sid           = COALESCE(?, sid),
+        active        = COALESCE(?, active),
+        traffic_limit = COALESCE(?, traffic_limit),
+        expires_at    = COALESCE(?, expires_at),
+        version       = version + 1
+    WHERE username = ?
+"""
+
+
+def _existing(cur: sqlite3.Cursor, column: str, values: list[str]) -> dict[str, str]:
+    """Maps each of `values` found in users.<column> to its username."""
+    found = {}
+    for i in range(0, len(values), 500):
+        chunk = values[i:i + 500]
+        cur.execute(
+            f"SELECT {column}, username FROM users WHERE {column} IN ({','.join('?' * len(chunk))})",
+            chunk,
+        )
+        found.update({r[0]: r[1] for r in cur.fetchall()})
+    return found
+
+
+@_timed
+def _bulk_batch(cur: sqlite3.Cursor, rows: list[dict]) -> list[dict]:
+    """Classifies and applies one batch inside the caller's transaction; returns per-row results."""
+    users = _existing(cur, "username", [r["username"] for r in rows if "error" not in r])
+    sids  = _existing(cur, "sid", [r["sid"] for r in rows if r.get("sid") and "error" not in r])
+    inserts, updates, results = [], [], []
+    for r in rows:
+        username, sid = r["username"], r.get("sid")
+        result = {"line": r["line"], "username": username}
+        results.append(result)
+        if "error" in r:
+            result.update(status="invalid", error=r["error"])
+            continue
+        if sid and sids.get(sid, username) != username:
+            result.update(status="conflict", error=f"sid in use by {sids[sid]}")
+            continue
+        if r["op"] == "create":
+            if username in users:
+                result.update(status="conflict", error="already exists")
+                continue
+            password = r.get("password") or str(uuid.uuid4())
+            sid      = sid or secrets.token_urlsafe(12)
+            active   = 1 if r.get("active") is None else int(r["active"])
+            inserts.append((username, password, sid, active, r.get("traffic_limit") or 0, r.get("expires_at") or 0))
+            result.update(status="created", password=password, sid=sid)
+        else:
+            if username not in users:
+                result.update(status="not_found", error="does not exist")
+                continue
+            active = 0 if r["op"] == "deactivate" else None if r.get("active") is None else int(r["active"])
+            fields = (None, None, active, None, None) if r["op"] == "deactivate" else (
+                r.get("password"), sid, active, r.get("traffic_limit"), r.get("expires_at"),
+            )
+            updates.append((*fields, username))
+            result["status"] = "deactivated" if r["op"] == "deactivate" else "updated"
+        users[username] = username
+        if sid:
+            sids[sid] = username
+    cur.executemany(_BULK_INSERT, inserts)
+    cur.executemany(_BULK_UPDATE, updates)
+    if inserts or updates:
+        _log_change(cur, "user", None)
+    return results
+
+
+def bulk_users(rows, batch: int = _BULK_BATCH):
     """
-    Validates user credentials and checks limits.
-    Returns (ok, reason) — reason is "" if ok, otherwise "invalid"/"inactive"/"expired"/"overlimit".
+    Creates, updates and deactivates users `batch` rows per transaction and
+    yields one result per row as each batch commits: {line, username, status}
+    plus password/sid for created users or an error. Invalid and conflicting
+    rows are reported and skipped; they never abort the rest of their batch.
     """
+    pending = []
+    for row in itertools.chain(rows, [None]):
+        if row is not None:
+            pending.append(row)
+            if len(pending) < batch:
+                continue
+        if not pending:
+            continue
+        # fetched per batch: a streaming response may resume us on another thread
+        conn = get_db()
+        try:
+            with conn:
+                results = _bulk_batch(conn.cursor(), pending)
+        except sqlite3.IntegrityError:
+            # raced with another writer: redo the batch a row at a time so only
+            # the offending rows fail
+            results = []
+            for r in pending:
+                try:
+                    with conn:
+                        results.extend(_bulk_batch(conn.cursor(), [r]))
+                except sqlite3.IntegrityError as e:
+                    results.append({"line": r["line"], "username": r["username"], "status": "conflict", "error": str(e)})
+        invalidate_auth_cache()
+        _bump_generation()
+        pending = []
+        yield from results
+
+
+# ── auth ──────────────────────────────────────────────────────────────────────
+
+# username -> {password, active, traffic_limit, expires_at, total, loaded_at};
+# totals are kept current by record_traffic, the rest by the user writers
+_auth_cache: dict[str, dict] = {}
+_auth_cache_lock = threading.Lock()
+
+
+@_timed
+def _load_auth_entry(username: str) -> dict | None:
     conn = get_db()
     cur  = conn.cursor()
     cur.execute("""
-        SELECT u.active, u.traffic_limit, u.expires_at,
-               COALESCE(SUM(t.tx + t.rx), 0) AS total_traffic
+        SELECT u.password, u.active, u.traffic_limit, u.expires_at,
+               COALESCE(t.tx + t.rx, 0) AS total
         FROM users u
-        LEFT JOIN traffic t ON t.username = u.username
-        WHERE u.username = ? AND u.password = ?
-        GROUP BY u.username
-    """, (username, password))
+        LEFT JOIN user_traffic_totals t ON t.username = u.username
+        WHERE u.username = ?
+    """, (username,))
     row = cur.fetchone()
-    conn.close()
-
     if not row:
+        return None
+    entry = {**dict(row), "loaded_at": time.monotonic()}
+    with _auth_cache_lock:
+        _auth_cache[username] = entry
+    return entry
+
+
+def auth_cached(username: str) -> bool:
+    """True if check_auth(username, ...) would be answered without touching the database."""
+    entry = _auth_cache.get(username)
+    return entry is not None and time.monotonic() - entry["loaded_at"] <= _CACHE_TTL
+
+
+def cached_password(username: str) -> str | None:
+    """The password the auth cache holds for `username`, even if the entry is stale; None if it has no entry."""
+    entry = _auth_cache.get(username)
+    return entry["password"] if entry is not None else None
+
+
+def invalidate_auth_cache(username: str | None = None) -> None:
+    with _auth_cache_lock:
+        if username is None:
+            _auth_cache.clear()
+        else:
+            _auth_cache.pop(username, None)
+
+
+def _refusal(entry: dict | None) -> str:
+    if not entry:
+        return "invalid"
+    if not entry["active"]:
+        return "inactive"
+    if entry["expires_at"] and entry["expires_at"] < int(time.time()):
+        return "expired"
+    if entry["traffic_limit"] and entry["total"] >= entry["traffic_limit"]:
+        return "overlimit"
+    return ""
+
+
+def _auth_entry(username: str) -> dict | None:
+    entry = _auth_cache.get(username)
+    if entry is None or time.monotonic() - entry["loaded_at"] > _CACHE_TTL:
+        entry = _load_auth_entry(username)
+    return entry
+
+
+def check_auth(username: str, password: str) -> tuple[bool, str]:
+    """
+    Validates user credentials and checks limits.
+    Returns (ok, reason) — reason is "" if ok, otherwise "invalid"/"inactive"/"expired"/"overlimit".
+    Known users are answered from memory; only a cold or stale entry touches the database.
+    """
+    entry = _auth_entry(username)
+    if entry and entry["password"] != password:
         return False, "invalid"
-    if not row["active"]:
-        return False, "inactive"
-    if row["expires_at"] and row["expires_at"] < int(time.time()):
-        return False, "expired"
-    if row["traffic_limit"] and row["total_traffic"] >= row["traffic_limit"]:
-        return False, "overlimit"
+    reason = _refusal(entry)
+    return not reason, reason
 
-    return True, ""
+
+def refused_users(usernames) -> dict[str, str]:
+    """
+    Returns {username: reason} for those of `usernames` that check_auth would
+    currently refuse whatever the password: unknown, inactive, expired or over limit.
+    """
+    refused = {}
+    for username in usernames:
+        reason = _refusal(_auth_entry(username))
+        if reason:
+            refused[username] = reason
+    return refused
+
+
+def remaining_quota(usernames) -> dict[str, int]:
+    """Returns {username: bytes left before traffic_limit} for those of `usernames` that have a limit."""
+    remaining = {}
+    for username in usernames:
+        entry = _auth_entry(username)
+        if entry and entry["traffic_limit"]:
+            remaining[username] = max(entry["traffic_limit"] - entry["total"], 0)
+    return remaining
 
 
 # ── traffic ───────────────────────────────────────────────────────────────────
 
+# only rows newer than the widest window (week or month) are scanned;
+# all-time totals come from user_traffic_totals
 _TRAFFIC_SELECT = """
     SELECT
         username,
-        SUM(CASE WHEN ts >= strftime('%Y-%m-%dT%H:%M:%SZ', 'now', '-60 minutes')             THEN tx + rx ELSE 0 END) AS hour,
-        SUM(CASE WHEN ts >= strftime('%Y-%m-%dT%H:%M:%SZ', 'now', 'start of day')            THEN tx + rx ELSE 0 END) AS day,
-        SUM(CASE WHEN ts >= strftime('%Y-%m-%dT%H:%M:%SZ', 'now', '-6 days', 'start of day') THEN tx + rx ELSE 0 END) AS week,
-        SUM(CASE WHEN ts >= strftime('%Y-%m-%dT%H:%M:%SZ', 'now', 'start of month')          THEN tx + rx ELSE 0 END) AS month,
-        SUM(tx + rx) AS total
+        SUM(CASE WHEN ts >= :hour  THEN tx + rx ELSE 0 END) AS hour,
+        SUM(CASE WHEN ts >= :day   THEN tx + rx ELSE 0 END) AS day,
+        SUM(CASE WHEN ts >= :week  THEN tx + rx ELSE 0 END) AS week,
+        SUM(CASE WHEN ts >= :month THEN tx + rx ELSE 0 END) AS month
     FROM traffic
+    WHERE ts >= min(:week, :month)
 """
 
 
+def _traffic_windows() -> dict[str, int]:
+    now   = datetime.now(timezone.utc)
+    today = now.replace(hour=0, minute=0, second=0, microsecond=0)
+    return {
+        "hour":  int(now.timestamp()) - 3600,
+        "day":   int(today.timestamp()),
+        "week":  int((today - timedelta(days=6)).timestamp()),
+        "month": int(today.replace(day=1).timestamp()),
+    }
+
+
+@_timed
 def get_traffic(username: str | None = None) -> list[dict]:
     conn   = get_db()
     cur    = conn.cursor()
     where  = "WHERE username = ?" if username else ""
     params = (username,) if username else ()
-    cur.execute(f"{_TRAFFIC_SELECT} {where} GROUP BY username ORDER BY total DESC", params)
-    rows = cur.fetchall()
-    conn.close()
-    return [
-        {
-            "username": r["username"],
-            "hour":     int(r["hour"]  or 0),
-            "day":      int(r["day"]   or 0),
-            "week":     int(r["week"]  or 0),
-            "month":    int(r["month"] or 0),
-            "total":    int(r["total"] or 0),
-        }
-        for r in rows
-    ]
+    cur.execute(f"SELECT username, tx + rx AS total FROM user_traffic_totals {where}", params)
+    totals = {r["username"]: r["total"] for r in cur.fetchall()}
+    and_where = "AND username = :username" if username else ""
+    cur.execute(f"{_TRAFFIC_SELECT} {and_where} GROUP BY username", {**_traffic_windows(), "username": username})
+    windows = {r["username"]: r for r in cur.fetchall()}
+    result = []
+    for name, total in totals.items():
+        w = windows.get(name)
+        result.append({
+            "username": name,
+            "hour":     int(w["hour"]  or 0) if w else 0,
+            "day":      int(w["day"]   or 0) if w else 0,
+            "week":     int(w["week"]  or 0) if w else 0,
+            "month":    int(w["month"] or 0) if w else 0,
+            "total":    int(total or 0),
+        })
+    result.sort(key=lambda r: r["total"], reverse=True)
+    return result
 
 
-def delete_traffic(username: str | None = None) -> int:
+# series buckets are aligned to multiples of `step` seconds since the epoch
+# (UTC); rolled-up rows sit at the start of their hour/day/month, so a step
+# finer than a row's span puts all of that row's bytes in one bucket
+_SERIES_CHUNK = 1000  # buckets per query
+
+
+@_timed
+def _series_window(lo: int, hi: int, step: int, username: str | None, server: str | None, by_server: bool) -> list:
+    where  = ["ts >= :lo", "ts < :hi"]
+    params = {"lo": lo, "hi": hi, "step": step, "username": username, "server": server}
+    if username:
+        where.append("username = :username")
+    if server:
+        where.append("server = :server")
+    cols = "bucket, server" if by_server else "bucket"
     conn = get_db()
     cur  = conn.cursor()
-    if username:
-        cur.execute("DELETE FROM traffic WHERE username = ?", (username,))
-    else:
-        cur.execute("DELETE FROM traffic")
-    count = cur.rowcount
-    conn.commit()
-    conn.close()
+    cur.execute(f"""
+        SELECT ts - ts % :step AS bucket, {'server,' if by_server else ''}
+               SUM(tx) AS tx, SUM(rx) AS rx
+        FROM traffic
+        WHERE {' AND '.join(where)}
+        GROUP BY {cols}
+        ORDER BY {cols}
+    """, params)
+    return cur.fetchall()
+
+
+def traffic_series(
+    start: int,
+    end: int,
+    step: int,
+    *,
+    username: str | None = None,
+    server: str | None = None,
+    by_server: bool = False,
+):
+    """
+    Yields {ts, tx, rx} (plus server if `by_server`) per non-empty bucket of
+    [start, end), oldest first, summed in SQL. Runs one query per
+    _SERIES_CHUNK buckets, so a long range never holds a read open or gets
+    materialized at once.
+    """
+    lo = start - start % step
+    while lo < end:
+        hi = min(lo + step * _SERIES_CHUNK, end)
+        for r in _series_window(max(lo, start), hi, step, username, server, by_server):
+            point = {"ts": r["bucket"], "tx": r["tx"], "rx": r["rx"]}
+            if by_server:
+                point["server"] = r["server"]
+            yield point
+        lo = hi
+
+
+def record_traffic(server: str, stats: dict[str, dict]) -> int:
+    """
+    Stores one poll's worth of per-user counters from a hysteria node.
+    Returns the number of rows written.
+    """
+    return record_traffic_batch([(int(time.time()), server, stats, None)])
+
+
+@_timed
+def record_traffic_batch(polls: list[tuple[int, str, dict[str, dict], int | None]]) -> int:
+    """
+    Stores several (ts, server, stats, poll_id) polls in a single transaction.
+    A poll with a journal id is stored only if its journal entry is still
+    'fetched', and the entry is removed in the same transaction, so replaying a
+    poll (e.g. during recovery) never counts it twice.
+    Returns the number of rows written.
+    """
+    conn = get_db()
+    rows = []
+    with conn:
+        cur = conn.cursor()
+        for ts, server, stats, poll_id in polls:
+            if poll_id is not None:
+                cur.execute("DELETE FROM poll_journal WHERE id = ? AND state = 'fetched'", (poll_id,))
+                if cur.rowcount == 0:
+                    continue
+            rows.extend(
+                (ts, server, username, s.get("tx", 0), s.get("rx", 0))
+                for username, s in stats.items()
+                if s.get("tx", 0) or s.get("rx", 0)
+            )
+        cur.executemany("INSERT INTO traffic (ts, server, username, tx, rx) VALUES (?, ?, ?, ?, ?)", rows)
+        cur.executemany("""
+            INSERT INTO user_traffic_totals (username, tx, rx) VALUES (?, ?, ?)
+            ON CONFLICT (username) DO UPDATE SET tx = tx + excluded.tx, rx = rx + excluded.rx
+        """, [(username, tx, rx) for _, _, username, tx, rx in rows])
+        if rows:
+            # one per batch: other processes reload their cached totals on sync
+            _log_change(cur, "traffic", None)
+    with _auth_cache_lock:
+        for _, _, username, tx, rx in rows:
+            entry = _auth_cache.get(username)
+            if entry is not None:
+                entry["total"] += tx + rx
+    return len(rows)
+
+
+@_timed
+def delete_traffic(username: str | None = None) -> int:
+    conn = get_db()
+    with conn:
+        cur = conn.cursor()
+        _log_change(cur, "user", username or None)
+        if username:
+            cur.execute("DELETE FROM traffic WHERE username = ?", (username,))
+            count = cur.rowcount
+            cur.execute("DELETE FROM user_traffic_totals WHERE username = ?", (username,))
+        else:
+            cur.execute("DELETE FROM traffic")
+            count = cur.rowcount
+            cur.execute("DELETE FROM user_traffic_totals")
+    invalidate_auth_cache(username)
     return count
 
 
+def _rebuild_traffic_totals(cur: sqlite3.Cursor) -> None:
+    cur.execute("DELETE FROM user_traffic_totals")
+    cur.execute("""
+        INSERT INTO user_traffic_totals (username, tx, rx)
+        SELECT username, SUM(tx), SUM(rx) FROM traffic GROUP BY username
+    """)
+
+
+@_timed
+def rebuild_traffic_totals() -> None:
+    conn = get_db()
+    with conn:
+        cur = conn.cursor()
+        _rebuild_traffic_totals(cur)
+        _log_change(cur, "user", None)
+    invalidate_auth_cache()
+
+
+@_timed
+def check_traffic_totals() -> list[dict]:
+    """
+    Compares user_traffic_totals against the raw traffic table.
+    Returns one {username, tx, rx, raw_tx, raw_rx} per mismatching user — empty if consistent.
+    """
+    conn = get_db()
+    cur  = conn.cursor()
+    cur.execute("""
+        WITH raw AS (SELECT username, SUM(tx) AS tx, SUM(rx) AS rx FROM traffic GROUP BY username),
+             names AS (SELECT username FROM raw UNION SELECT username FROM user_traffic_totals)
+        SELECT n.username,
+               COALESCE(t.tx, 0) AS tx,     COALESCE(t.rx, 0) AS rx,
+               COALESCE(r.tx, 0) AS raw_tx, COALESCE(r.rx, 0) AS raw_rx
+        FROM names n
+        LEFT JOIN user_traffic_totals t ON t.username = n.username
+        LEFT JOIN raw                 r ON r.username = n.username
+        WHERE COALESCE(t.tx, 0) != COALESCE(r.tx, 0) OR COALESCE(t.rx, 0) != COALESCE(r.rx, 0)
+        ORDER BY n.username
+    """)
+    rows = cur.fetchall()
+    return [dict(r) for r in rows]
+
+
+# ── poll journal ──────────────────────────────────────────────────────────────
+
+# every /traffic?clear=1 read goes through here: an entry is 'pending' while the
+# request is in flight, 'fetched' once the node's answer is stored (the node has
+# cleared its counters by then, so this row is the only copy), and is deleted
+# when record_traffic_batch commits its rows. A 'pending' entry that never got
+# an answer may have been cleared on the node anyway; it is marked 'lost'.
+
+@_timed
+def journal_begin(host: str) -> int:
+    conn = get_db()
+    with conn:
+        cur = conn.cursor()
+        cur.execute("INSERT INTO poll_journal (host, ts) VALUES (?, ?)", (host, int(time.time())))
+    return cur.lastrowid
+
+
+@_timed
+def journal_fetched(poll_id: int, stats: dict[str, dict]) -> None:
+    conn = get_db()
+    with conn:
+        conn.execute(
+            "UPDATE poll_journal SET state = 'fetched', payload = ? WHERE id = ?",
+            (json.dumps(stats, separators=(",", ":")), poll_id),
+        )
+
+
+@_timed
+def journal_abandon(poll_id: int, lost: bool) -> None:
+    """Closes a poll that got no answer; `lost` if the node may have cleared its counters regardless."""
+    conn = get_db()
+    with conn:
+        if lost:
+            conn.execute("UPDATE poll_journal SET state = 'lost' WHERE id = ? AND state = 'pending'", (poll_id,))
+        else:
+            conn.execute("DELETE FROM poll_journal WHERE id = ? AND state = 'pending'", (poll_id,))
+
+
+@_timed
+def recover_journal(startup: bool = False) -> dict[str, int]:
+    """
+    Stores every fetched-but-uncommitted poll. On startup, polls still pending
+    belong to the previous process and can no longer be answered: they are
+    marked lost. Returns {"replayed", "rows", "lost"}.
+    """
+    conn = get_db()
+    cur  = conn.cursor()
+    cur.execute("SELECT id, host, ts, payload FROM poll_journal WHERE state = 'fetched' ORDER BY id")
+    polls = [(r["ts"], r["host"], json.loads(r["payload"]), r["id"]) for r in cur.fetchall()]
+    rows  = record_traffic_batch(polls) if polls else 0
+    lost  = 0
+    if startup:
+        with conn:
+            cur.execute("UPDATE poll_journal SET state = 'lost' WHERE state = 'pending'")
+            lost = cur.rowcount
+    return {"replayed": len(polls), "rows": rows, "lost": lost}
+
+
+@_timed
+def list_lost_polls() -> list[dict]:
+    conn = get_db()
+    cur  = conn.cursor()
+    cur.execute("SELECT id, host, ts FROM poll_journal WHERE state = 'lost' ORDER BY id")
+    return [dict(r) for r in cur.fetchall()]
+
+
+# ── traffic rollups ───────────────────────────────────────────────────────────
+#
+# raw rows (span 0) older than the raw retention are compacted into hourly rows,
+# those into daily rows, and those into monthly rows. compacted rows carry the
+# start of their bucket as ts, so every window in _TRAFFIC_SELECT still lines up
+# with bucket boundaries: the hour window only ever sees raw rows, day/week see
+# hourly or daily rows, and monthly rows always end before the current week.
+
+# (name, source span, target span, bucket format, rows per transaction, config key, unit, minimum)
+_ROLLUP_LEVELS = [
+    ("hour",  0,     3600,    "%Y-%m-%dT%H:00:00Z", "+1 day",   "traffic_raw_retention_hours",   "hours", 1),
+    ("day",   3600,  86400,   "%Y-%m-%dT00:00:00Z", "+1 month", "traffic_hourly_retention_days", "days",  1),
+    ("month", 86400, 2592000, "%Y-%m-01T00:00:00Z", "+1 year",  "traffic_daily_retention_days",  "days",  7),
+]
+
+
+def _rollup_level(src: int, dst: int, fmt: str, step: str, age: str) -> int:
+    """
+    Compacts `src`-span rows older than `age` into `dst`-span buckets. Each
+    transaction covers one `step` of time so concurrent writers are never
+    locked out for long. Returns the number of source rows folded away.
+    """
+    conn   = get_db()
+    cur    = conn.cursor()
+    params = {"fmt": fmt, "step": step, "src": src, "dst": dst}
+    params["cutoff"] = cur.execute(
+        "SELECT CAST(strftime('%s', strftime(:fmt, 'now', :age)) AS INTEGER)", {**params, "age": age}
+    ).fetchone()[0]
+    folded = 0
+    while True:
+        row = cur.execute("""
+            SELECT CAST(strftime('%s', strftime(:fmt, MIN(ts), 'unixepoch')) AS INTEGER)
+            FROM traffic WHERE span = :src AND ts < :cutoff
+        """, params).fetchone()
+        if row[0] is None:
+            break
+        params["lo"] = row[0]
+        params["hi"] = min(cur.execute(
+            "SELECT CAST(strftime('%s', strftime(:fmt, :lo, 'unixepoch', :step)) AS INTEGER)", params
+        ).fetchone()[0], params["cutoff"])
+        with conn:
+            cur.execute("""
+                INSERT INTO traffic (ts, server, username, tx, rx, span)
+                SELECT CAST(strftime('%s', strftime(:fmt, ts, 'unixepoch')) AS INTEGER) AS bucket,
+                       server, username, SUM(tx), SUM(rx), :dst
+                FROM traffic
+                WHERE span = :src AND ts >= :lo AND ts < :hi
+                GROUP BY bucket, server, username
+            """, params)
+            cur.execute("DELETE FROM traffic WHERE span = :src AND ts >= :lo AND ts < :hi", params)
+            folded += cur.rowcount
+    return folded
+
+
+@_timed
+def rollup_traffic() -> dict[str, int]:
+    """
+    Runs every rollup level once with the retention configured in the config table.
+    Returns {level: source rows compacted}. Skipped while a traffic_ts migration
+    (see _migrate_traffic_ts) is still copying rows.
+    """
+    conn = get_db()
+    migrating = conn.execute(
+        "SELECT 1 FROM sqlite_master WHERE type = 'table' AND name = 'traffic_v2'"
+    ).fetchone() is not None
+    if migrating:
+        return {name: 0 for name, *_ in _ROLLUP_LEVELS}
+    result = {}
+    for name, src, dst, fmt, step, key, unit, minimum in _ROLLUP_LEVELS:
+        keep = max(int(get_config(key, "0") or 0), minimum)
+        result[name] = _rollup_level(src, dst, fmt, step, f"-{keep} {unit}")
+    prune_changes()
+    return result
+
+
+# ── export ────────────────────────────────────────────────────────────────────
+#
+# exports walk a table in primary-key order one page per query, so each read is
+# short (the poller's writes never wait on it), memory stays at one page, and a
+# streaming response may resume the generator on another thread between pages
+
+_EXPORT_PAGE = 5000
+
+TRAFFIC_EXPORT_COLUMNS = ("id", "ts", "server", "username", "tx", "rx", "span")
+USERS_EXPORT_COLUMNS   = ("username", "password", "sid", "active", "traffic_limit", "expires_at", "version")
+
+
+@_timed
+def _export_page(sql: str, params: tuple) -> list:
+    conn = get_db()
+    cur  = conn.cursor()
+    cur.execute(sql, params)
+    return cur.fetchall()
+
+
+def export_traffic(start: int | None = None, end: int | None = None, page: int = _EXPORT_PAGE):
+    """
+    Yields traffic rows as tuples of TRAFFIC_EXPORT_COLUMNS in (ts, id) order,
+    optionally only start <= ts < end. Pages follow the traffic_time index.
+    """
+    sql = f"""
+        SELECT {', '.join(TRAFFIC_EXPORT_COLUMNS)} FROM traffic
+        WHERE (ts, id) > (?, ?) AND ts < ?
+        ORDER BY ts, id LIMIT ?
+    """
+    last = (start - 1 if start else -1, 1 << 62)
+    while True:
+        rows = _export_page(sql, (*last, end or 1 << 62, page))
+        yield from map(tuple, rows)
+        if len(rows) < page:
+            return
+        last = (rows[-1]["ts"], rows[-1]["id"])
+
+
+def export_users(page: int = _EXPORT_PAGE):
+    """Yields users as tuples of USERS_EXPORT_COLUMNS in username order."""
+    sql = f"SELECT {', '.join(USERS_EXPORT_COLUMNS)} FROM users WHERE username > ? ORDER BY username LIMIT ?"
+    last = ""
+    while True:
+        rows = _export_page(sql, (last, page))
+        yield from map(tuple, rows)
+        if len(rows) < page:
+            return
+        last = rows[-1]["username"]
+
+
 # ── hosts ─────────────────────────────────────────────────────────────────────
 
+@_timed
 def list_hosts(active_only: bool = False) -> list[dict]:
     conn = get_db()
     cur  = conn.cursor()
     where = "WHERE active = 1" if active_only else ""
     cur.execute(f"SELECT * FROM hosts {where} ORDER BY address")
     rows = cur.fetchall()
-    conn.close()
     return [dict(r) for r in rows]
 
 
+@_timed
 def get_host(address: str) -> sqlite3.Row | None:
     conn = get_db()
     cur  = conn.cursor()
     cur.execute("SELECT * FROM hosts WHERE address = ?", (address,))
     row = cur.fetchone()
-    conn.close()
     return row
 
 
@@ -282,6 +1224,7 @@ def host_exists(address: str) -> bool:
     return get_host(address) is not None
 
 
+@_timed
 def create_host(
     address: str,
     name: str,
@@ -291,19 +1234,35 @@ def create_host(
     port: int = 443,
     active: bool = True,
 ) -> dict | None:
-    if host_exists(address):
-        return None
     conn = get_db()
-    cur  = conn.cursor()
-    cur.execute(
-        "INSERT INTO hosts (address, name, port, api_address, api_secret, active) VALUES (?, ?, ?, ?, ?, ?)",
-        (address, name, port, api_address, api_secret, int(active)),
-    )
-    conn.commit()
-    conn.close()
-    return {"address": address, "name": name, "port": port, "api_address": api_address, "api_secret": api_secret, "active": active}
+    with conn:
+        cur = conn.cursor()
+        cur.execute(
+            "INSERT INTO hosts (address, name, port, api_address, api_secret, active) VALUES (?, ?, ?, ?, ?, ?)"
+            " ON CONFLICT (address) DO NOTHING",
+            (address, name, port, api_address, api_secret, int(active)),
+        )
+        if cur.rowcount == 0:
+            return None
+        _log_change(cur, "host", address, 1)
+    _bump_generation()
+    return {"address": address, "name": name, "port": port, "api_address": api_address, "api_secret": api_secret, "active": active, "version": 1}
+
 
+_EDIT_HOST = """
+    UPDATE hosts SET
+        name        = COALESCE(?, name),
+        port        = COALESCE(?, port),
+        api_address = COALESCE(?, api_address),
+        api_secret  = COALESCE(?, api_secret),
+        active      = COALESCE(?, active),
+        version     = version + 1
+    WHERE address = ? AND (? IS NULL OR version = ?)
+    RETURNING *
+"""
 
+
+@_timed
 def edit_host(
     address: str,
     *,
@@ -312,70 +1271,91 @@ def edit_host(
     api_address: str | None = None,
     api_secret: str | None = None,
     active: bool | None = None,
-) -> bool:
-    if not host_exists(address):
-        return False
-    conn = get_db()
-    cur  = conn.cursor()
-    if name is not None:
-        cur.execute("UPDATE hosts SET name = ? WHERE address = ?", (name, address))
-    if port is not None:
-        cur.execute("UPDATE hosts SET port = ? WHERE address = ?", (port, address))
-    if api_address is not None:
-        cur.execute("UPDATE hosts SET api_address = ? WHERE address = ?", (api_address, address))
-    if api_secret is not None:
-        cur.execute("UPDATE hosts SET api_secret = ? WHERE address = ?", (api_secret, address))
-    if active is not None:
-        cur.execute("UPDATE hosts SET active = ? WHERE address = ?", (int(active), address))
-    conn.commit()
-    conn.close()
-    return True
+    if_version: int | None = None,
+) -> sqlite3.Row | None:
+    """Like edit_user: one statement, returns the updated row or None; no fields, no change."""
+    fields = (name, port, api_address, api_secret, None if active is None else int(active))
+    conn   = get_db()
+    if all(f is None for f in fields):
+        return conn.execute(
+            "SELECT * FROM hosts WHERE address = ? AND (? IS NULL OR version = ?)", (address, if_version, if_version),
+        ).fetchone()
+    with conn:
+        cur = conn.cursor()
+        cur.execute(_EDIT_HOST, (*fields, address, if_version, if_version))
+        row = cur.fetchone()
+        if row is None:
+            return None
+        _log_change(cur, "host", address, row["version"])
+    _bump_generation()
+    return row
 
 
+@_timed
 def delete_host(address: str) -> bool:
-    if not host_exists(address):
-        return False
     conn = get_db()
-    cur  = conn.cursor()
-    cur.execute("DELETE FROM hosts WHERE address = ?", (address,))
-    conn.commit()
-    conn.close()
+    with conn:
+        cur = conn.cursor()
+        cur.execute("DELETE FROM hosts WHERE address = ?", (address,))
+        if cur.rowcount == 0:
+            return False
+        _log_change(cur, "host", address)
+    _bump_generation()
     return True
 
 
 # ── config ────────────────────────────────────────────────────────────────────
 
+_config_cache: dict[str, str] = {}
+_config_loaded_at: float | None = None
+
+
+def _invalidate_config_cache() -> None:
+    global _config_loaded_at
+    _config_loaded_at = None
+
+
+def config_cached() -> bool:
+    """True if get_config() would be answered without touching the database."""
+    return _config_loaded_at is not None and time.monotonic() - _config_loaded_at <= _CACHE_TTL
+
+
 def get_config(key: str, default: str = "") -> str:
-    conn = get_db()
-    cur  = conn.cursor()
-    cur.execute("SELECT value FROM config WHERE key = ?", (key,))
-    row = cur.fetchone()
-    conn.close()
-    return row["value"] if row else default
+    global _config_cache, _config_loaded_at
+    if _config_loaded_at is None or time.monotonic() - _config_loaded_at > _CACHE_TTL:
+        _config_cache     = list_config()
+        _config_loaded_at = time.monotonic()
+    return _config_cache.get(key, default)
 
 
+@_timed
 def set_config(key: str, value: str) -> None:
     conn = get_db()
-    cur  = conn.cursor()
-    cur.execute("INSERT OR REPLACE INTO config (key, value) VALUES (?, ?)", (key, value))
-    conn.commit()
-    conn.close()
+    with conn:
+        cur = conn.cursor()
+        _log_change(cur, "config", key)
+        cur.execute("INSERT OR REPLACE INTO config (key, value) VALUES (?, ?)", (key, value))
+    _invalidate_config_cache()
+    _bump_generation()
 
 
+@_timed
 def list_config() -> dict[str, str]:
     conn = get_db()
     cur  = conn.cursor()
     cur.execute("SELECT key, value FROM config ORDER BY key")
     rows = cur.fetchall()
-    conn.close()
     return {r["key"]: r["value"] for r in rows}
 
 
+@_timed
 def delete_config(key: str) -> bool:
     conn = get_db()
-    cur  = conn.cursor()
-    cur.execute("DELETE FROM config WHERE key = ?", (key,))
-    deleted = cur.rowcount > 0
-    conn.commit()
-    conn.close()
+    with conn:
+        cur = conn.cursor()
+        _log_change(cur, "config", key)
+        cur.execute("DELETE FROM config WHERE key = ?", (key,))
+        deleted = cur.rowcount > 0
+    _invalidate_config_cache()
+    _bump_generation()
     return deleted
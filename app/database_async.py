@@ -0,0 +1,109 @@
+import asyncio
+import functools
+import logging
+import os
+from concurrent.futures import ThreadPoolExecutor
+
+from . import database, log
+
+# awaitable versions of the app.database functions for code on the event loop.
+# calls run on a bounded pool of HYST_DB_WORKERS threads (each with its own pooled
+# connection), so a slow query only ties up a worker, never the loop; lookups the
+# in-memory caches can answer are served inline
+_DB_WORKERS = int(os.environ.get("HYST_DB_WORKERS", "4"))
+_executor   = ThreadPoolExecutor(max_workers=_DB_WORKERS, thread_name_prefix="db")
+
+
+async def run(fn, *args, **kwargs):
+    """Runs a blocking database call on the database worker pool."""
+    loop = asyncio.get_running_loop()
+    return await loop.run_in_executor(_executor, functools.partial(fn, *args, **kwargs))
+
+
+def _wrap(fn):
+    @functools.wraps(fn)
+    async def wrapper(*args, **kwargs):
+        return await run(fn, *args, **kwargs)
+    return wrapper
+
+
+# in-memory, never blocks
+generation = database.generation
+
+
+# ── coordination ──────────────────────────────────────────────────────────────
+
+_SYNC_INTERVAL = float(os.environ.get("HYST_SYNC_INTERVAL", "1"))
+
+acquire_lease = _wrap(database.acquire_lease)
+release_lease = _wrap(database.release_lease)
+
+
+async def follow_changes() -> None:
+    """Applies user/host/config writes made by other processes to this process's caches."""
+    while True:
+        try:
+            await run(database.sync_changes)
+        except Exception as e:
+            log.event("sync_error", logging.ERROR, error=str(e) or type(e).__name__)
+        await asyncio.sleep(_SYNC_INTERVAL)
+
+
+# ── users ─────────────────────────────────────────────────────────────────────
+
+user_exists             = _wrap(database.user_exists)
+get_user                = _wrap(database.get_user)
+get_user_by_sid         = _wrap(database.get_user_by_sid)
+list_users              = _wrap(database.list_users)
+list_users_with_traffic = _wrap(database.list_users_with_traffic)
+list_users_page         = _wrap(database.list_users_page)
+create_user             = _wrap(database.create_user)
+edit_user               = _wrap(database.edit_user)
+delete_user             = _wrap(database.delete_user)
+
+
+# ── auth ──────────────────────────────────────────────────────────────────────
+
+async def check_auth(username: str, password: str) -> tuple[bool, str]:
+    if database.auth_cached(username):
+        return database.check_auth(username, password)
+    return await run(database.check_auth, username, password)
+
+
+refused_users   = _wrap(database.refused_users)
+remaining_quota = _wrap(database.remaining_quota)
+
+
+# ── traffic ───────────────────────────────────────────────────────────────────
+
+get_traffic    = _wrap(database.get_traffic)
+record_traffic = _wrap(database.record_traffic)
+delete_traffic = _wrap(database.delete_traffic)
+
+journal_begin   = _wrap(database.journal_begin)
+journal_fetched = _wrap(database.journal_fetched)
+journal_abandon = _wrap(database.journal_abandon)
+recover_journal = _wrap(database.recover_journal)
+
+
+# ── hosts ─────────────────────────────────────────────────────────────────────
+
+list_hosts  = _wrap(database.list_hosts)
+get_host    = _wrap(database.get_host)
+host_exists = _wrap(database.host_exists)
+create_host = _wrap(database.create_host)
+edit_host   = _wrap(database.edit_host)
+delete_host = _wrap(database.delete_host)
+
+
+# ── config ────────────────────────────────────────────────────────────────────
+
+async def get_config(key: str, default: str = "") -> str:
+    if database.config_cached():
+        return database.get_config(key, default)
+    return await run(database.get_config, key, default)
+
+
+set_config    = _wrap(database.set_config)
+list_config   = _wrap(database.list_config)
+delete_config = _wrap(database.delete_config)
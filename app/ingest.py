@@ -0,0 +1,91 @@
+import asyncio
+import queue
+import threading
+import time
+from concurrent.futures import Future
+
+from . import metrics
+from .database import record_traffic_batch
+
+# pollers put ("poll", ts, server, stats, poll_id) and ("flush", future) items here; a single
+# writer thread commits everything queued before a flush in one transaction
+_queue: queue.Queue = queue.Queue()
+_thread: threading.Thread | None = None
+_lock = threading.Lock()
+
+stats = {
+    "commits":             0,
+    "rows":                0,
+    "last_commit_latency": 0.0,
+    "max_commit_latency":  0.0,
+}
+
+
+def _run() -> None:
+    pending: list[tuple[int, str, dict, int | None]] = []
+    while True:
+        item = _queue.get()
+        if item is None:
+            return
+        if item[0] == "poll":
+            pending.append(item[1:])
+            continue
+        future: Future = item[1]
+        if not future.set_running_or_notify_cancel():
+            # the poll cycle was cancelled; journaled polls are replayed by the next one
+            pending = []
+            continue
+        start = time.perf_counter()
+        try:
+            rows = record_traffic_batch(pending)
+        except Exception as e:
+            future.set_exception(e)
+        else:
+            latency = time.perf_counter() - start
+            stats["commits"]            += 1
+            stats["rows"]               += rows
+            stats["last_commit_latency"] = latency
+            stats["max_commit_latency"]  = max(stats["max_commit_latency"], latency)
+            metrics.ingest_rows.inc(amount=rows)
+            metrics.ingest_commit.observe(latency)
+            future.set_result(rows)
+        pending = []
+
+
+def _ensure_started() -> None:
+    global _thread
+    with _lock:
+        if _thread is None or not _thread.is_alive():
+            _thread = threading.Thread(target=_run, name="traffic-writer", daemon=True)
+            _thread.start()
+
+
+def submit(server: str, traffic: dict[str, dict], poll_id: int | None = None) -> None:
+    """Queues one host's /traffic response (and its journal id) for the next flush."""
+    _ensure_started()
+    _queue.put(("poll", int(time.time()), server, traffic, poll_id))
+
+
+async def flush() -> int:
+    """Commits everything submitted so far in one transaction; returns rows written."""
+    _ensure_started()
+    future: Future = Future()
+    _queue.put(("flush", future))
+    return await asyncio.wrap_future(future)
+
+
+def stop() -> None:
+    """
+    Stops the writer thread. Polls that were never flushed are dropped here;
+    they are still in the poll journal and get replayed on the next start.
+    """
+    global _thread
+    with _lock:
+        if _thread is not None:
+            _queue.put(None)
+            _thread.join()
+            _thread = None
+
+
+def queue_depth() -> int:
+    return _queue.qsize()
@@ -0,0 +1,127 @@
+import json
+import logging
+import logging.handlers
+import os
+import queue
+import random
+import sys
+import threading
+import time
+from datetime import datetime, timezone
+
+from . import metrics
+
+# structured logging: callers only put a record on a bounded queue, a background
+# listener thread formats it as one JSON line and writes it to stdout. A full
+# queue drops the record rather than blocking the event loop. Access lines
+# (/auth, /sub) are additionally sampled and rate-limited per kind.
+_LEVEL         = os.environ.get("HYST_LOG_LEVEL", "INFO").upper()
+_QUEUE_SIZE    = int(os.environ.get("HYST_LOG_QUEUE", "10000"))
+_ACCESS_RATE   = float(os.environ.get("HYST_LOG_ACCESS_RATE", "20"))   # lines/s per kind, 0 = unlimited
+_ACCESS_SAMPLE = float(os.environ.get("HYST_LOG_ACCESS_SAMPLE", "1"))  # fraction of access lines kept
+
+logger = logging.getLogger("hyst")
+logger.setLevel(_LEVEL)
+logger.propagate = False
+
+_queue: queue.Queue = queue.Queue(_QUEUE_SIZE)
+_listener: logging.handlers.QueueListener | None = None
+_lock = threading.Lock()
+
+# kind -> [tokens, last refill (monotonic), dropped since last line]
+_buckets: dict[str, list] = {}
+
+
+class _JsonFormatter(logging.Formatter):
+    def format(self, record: logging.LogRecord) -> str:
+        out = {
+            "ts":    datetime.fromtimestamp(record.created, timezone.utc).isoformat(timespec="milliseconds"),
+            "level": record.levelname.lower(),
+            "event": record.getMessage(),
+            **getattr(record, "fields", {}),
+        }
+        if record.exc_info:
+            out["exc"] = self.formatException(record.exc_info)
+        return json.dumps(out, ensure_ascii=False, default=str)
+
+
+class _StdoutHandler(logging.StreamHandler):
+    # resolves sys.stdout on every write so redirections (tests, benchmarks) apply
+    @property
+    def stream(self):
+        return sys.stdout
+
+    @stream.setter
+    def stream(self, _value):
+        pass
+
+
+class _QueueHandler(logging.handlers.QueueHandler):
+    def prepare(self, record: logging.LogRecord) -> logging.LogRecord:
+        # formatting happens on the listener thread, not the caller's
+        return record
+
+    def enqueue(self, record: logging.LogRecord) -> None:
+        try:
+            self.queue.put_nowait(record)
+        except queue.Full:
+            metrics.log_dropped.inc("queue_full")
+
+
+def _ensure_started() -> None:
+    global _listener
+    with _lock:
+        if _listener is not None:
+            return
+        if not logger.handlers:
+            logger.addHandler(_QueueHandler(_queue))
+        out = _StdoutHandler()
+        out.setFormatter(_JsonFormatter())
+        _listener = logging.handlers.QueueListener(_queue, out)
+        _listener.start()
+
+
+def stop() -> None:
+    """Writes out everything queued and stops the listener thread."""
+    global _listener
+    with _lock:
+        if _listener is not None:
+            _listener.stop()
+            _listener = None
+
+
+def event(name: str, level: int = logging.INFO, **fields) -> None:
+    """Logs one structured event, e.g. event("poll_error", logging.ERROR, host=..., error=...)."""
+    if not logger.isEnabledFor(level):
+        return
+    if _listener is None:
+        _ensure_started()
+    logger.log(level, name, extra={"fields": fields})
+
+
+def access(kind: str, **fields) -> None:
+    """
+    Logs a per-request access line, subject to HYST_LOG_ACCESS_SAMPLE and a
+    token bucket of HYST_LOG_ACCESS_RATE lines/s per kind. The next line that
+    gets through carries the number dropped before it.
+    """
+    if not logger.isEnabledFor(logging.INFO):
+        return
+    if _ACCESS_SAMPLE < 1 and random.random() >= _ACCESS_SAMPLE:
+        metrics.log_dropped.inc("sampled")
+        return
+    bucket = _buckets.get(kind)
+    if bucket is None:
+        bucket = _buckets.setdefault(kind, [_ACCESS_RATE, time.monotonic(), 0])
+    if _ACCESS_RATE > 0:
+        now       = time.monotonic()
+        bucket[0] = min(_ACCESS_RATE, bucket[0] + (now - bucket[1]) * _ACCESS_RATE)
+        bucket[1] = now
+        if bucket[0] < 1:
+            bucket[2] += 1
+            metrics.log_dropped.inc("rate_limited")
+            return
+        bucket[0] -= 1
+    if bucket[2]:
+        fields["dropped"], bucket[2] = bucket[2], 0
+    event(kind, **fields)
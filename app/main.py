@@ -6,20 +6,28 @@ from fastapi import FastAPI, Response
 from fastapi.responses import PlainTextResponse
 from fastapi.staticfiles import StaticFiles
 
-from .polling import poll_hysteria
-from .routes import auth, sub
-from .routes.api import users, traffic, hosts, config
+from . import ingest, log
+from .database_async import follow_changes
+from .polling import lead
+from .routes import auth, sub, metrics
+from .routes.api import users, traffic, hosts, config, changes, export
+from .utils.sub import load_templates
 
 
 @asynccontextmanager
 async def lifespan(_app: FastAPI):
-    task = asyncio.create_task(poll_hysteria())
+    load_templates()
+    tasks = [asyncio.create_task(lead()), asyncio.create_task(follow_changes())]
     yield
-    task.cancel()
-    try:
-        await task
-    except asyncio.CancelledError:
-        pass
+    for task in tasks:
+        task.cancel()
+    for task in tasks:
+        try:
+            await task
+        except asyncio.CancelledError:
+            pass
+    ingest.stop()
+    log.stop()
 
 
 public_app = FastAPI(lifespan=lifespan)
@@ -43,3 +51,6 @@ internal_app.include_router(users.router, prefix="/api")
 internal_app.include_router(traffic.router, prefix="/api")
 internal_app.include_router(hosts.router, prefix="/api")
 internal_app.include_router(config.router, prefix="/api")
+internal_app.include_router(changes.router, prefix="/api")
+internal_app.include_router(export.router, prefix="/api")
+internal_app.include_router(metrics.router)
@@ -0,0 +1,124 @@
+import bisect
+import functools
+import time
+
+# minimal prometheus text-format metrics (no client library needed).
+# Updates take no locks: observe()/inc() are a few list/float operations under
+# the GIL, so hot paths pay about a microsecond. Two threads racing on the same
+# series can very rarely lose an increment, which metrics tolerate.
+
+LATENCY_BUCKETS = (0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0)
+
+_registry: list = []
+
+
+def _escape(value: str) -> str:
+    return str(value).replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n")
+
+
+def _labels(names: tuple[str, ...], values: tuple, extra: str = "") -> str:
+    pairs = [f'{n}="{_escape(v)}"' for n, v in zip(names, values)]
+    if extra:
+        pairs.append(extra)
+    return "{" + ",".join(pairs) + "}" if pairs else ""
+
+
+def _fmt(value: float) -> str:
+    return str(int(value)) if float(value).is_integer() else repr(float(value))
+
+
+class Counter:
+    def __init__(self, name: str, help: str, labels: tuple[str, ...] = ()):
+        self.name, self.help, self.labels = name, help, labels
+        self._values: dict[tuple, float] = {}
+        _registry.append(self)
+
+    def inc(self, *labels, amount: float = 1) -> None:
+        self._values[labels] = self._values.get(labels, 0) + amount
+
+    def render(self) -> list[str]:
+        lines = [f"# HELP {self.name} {self.help}", f"# TYPE {self.name} counter"]
+        for labels, value in sorted(self._values.items()):
+            lines.append(f"{self.name}{_labels(self.labels, labels)} {_fmt(value)}")
+        return lines
+
+
+class Gauge(Counter):
+    def set(self, *labels, value: float) -> None:
+        self._values[labels] = value
+
+    def remove(self, *labels) -> None:
+        self._values.pop(labels, None)
+
+    def render(self) -> list[str]:
+        lines = super().render()
+        lines[1] = f"# TYPE {self.name} gauge"
+        return lines
+
+
+class Histogram:
+    def __init__(self, name: str, help: str, labels: tuple[str, ...] = (), buckets: tuple[float, ...] = LATENCY_BUCKETS):
+        self.name, self.help, self.labels, self.buckets = name, help, labels, buckets
+        # labels -> [per-bucket counts (last is +Inf), sum, count]
+        self._series: dict[tuple, list] = {}
+        _registry.append(self)
+
+    def observe(self, value: float, *labels) -> None:
+        series = self._series.get(labels)
+        if series is None:
+            series = self._series.setdefault(labels, [[0] * (len(self.buckets) + 1), 0.0, 0])
+        series[0][bisect.bisect_left(self.buckets, value)] += 1
+        series[1] += value
+        series[2] += 1
+
+    def time(self, *labels):
+        """Decorator recording each call's duration."""
+        def decorator(fn):
+            @functools.wraps(fn)
+            def wrapper(*args, **kwargs):
+                start = time.perf_counter()
+                try:
+                    return fn(*args, **kwargs)
+                finally:
+                    self.observe(time.perf_counter() - start, *labels)
+            return wrapper
+        return decorator
+
+    def render(self) -> list[str]:
+        lines = [f"# HELP {self.name} {self.help}", f"# TYPE {self.name} histogram"]
+        for labels, (counts, total, count) in sorted(self._series.items()):
+            cumulative = 0
+            for bound, n in zip(self.buckets + (float("inf"),), counts):
+                cumulative += n
+                le = '"+Inf"' if bound == float("inf") else f'"{_fmt(bound)}"'
+                lines.append(f"{self.name}_bucket{_labels(self.labels, labels, 'le=' + le)} {cumulative}")
+            lines.append(f"{self.name}_sum{_labels(self.labels, labels)} {_fmt(total)}")
+            lines.append(f"{self.name}_count{_labels(self.labels, labels)} {count}")
+        return lines
+
+
+def render() -> str:
+    lines = []
+    for metric in _registry:
+        lines.extend(metric.render())
+    return "\n".join(lines) + "\n"
+
+
+# ── metrics ───────────────────────────────────────────────────────────────────
+
+auth_seconds  = Histogram("hyst_auth_seconds", "/auth latency by decision", ("reason",))
+auth_negative = Counter("hyst_auth_negative_cache_total", "/auth failed-credential cache lookups", ("result",))
+auth_limited  = Counter("hyst_auth_rate_limited_total", "/auth requests refused by the per-ip failure limiter")
+auth_tracked  = Gauge("hyst_auth_tracked", "entries held by the /auth negative cache and limiter", ("table",))
+sub_seconds   = Histogram("hyst_sub_seconds", "/sub latency by format", ("format",))
+sub_cache     = Counter("hyst_sub_cache_total", "/sub render cache lookups", ("result",))
+poll_seconds  = Histogram("hyst_poll_seconds", "per-host poll duration", ("host",))
+poll_errors   = Counter("hyst_poll_errors_total", "failed host polls", ("host",))
+poll_cycle    = Histogram("hyst_poll_cycle_seconds", "duration of one poll_once batch")
+poll_interval = Gauge("hyst_poll_interval_seconds", "current adaptive poll interval", ("host",))
+kicks         = Counter("hyst_kicks_total", "users kicked by enforcement", ("reason",))
+db_seconds    = Histogram("hyst_db_seconds", "sqlite call duration by app.database function", ("function",))
+ingest_rows   = Counter("hyst_ingest_rows_total", "traffic rows committed by the ingest writer")
+ingest_commit = Histogram("hyst_ingest_commit_seconds", "ingest transaction duration")
+ingest_queue  = Gauge("hyst_ingest_queue_depth", "items waiting for the ingest writer")
+log_dropped   = Counter("hyst_log_dropped_total", "log lines not written", ("reason",))
@@ -1,58 +1,400 @@
 import asyncio
-from datetime import datetime, timezone
+import logging
+import os
+import random
+import secrets
+import socket
+import time
 
 import httpx
 
-from .database import get_db, list_hosts, get_config
+from . import ingest, log, metrics
+from .database import rollup_traffic
+from .database_async import (
+    list_hosts, get_config, refused_users, remaining_quota,
+    journal_begin, journal_fetched, journal_abandon, recover_journal,
+    acquire_lease, release_lease,
+)
+from .utils.domains import compile_rules, match
+from .utils.jsonstream import iter_array
+
+# address -> {polls, failures, last_latency, last_error}; updated after every host poll
+host_stats: dict[str, dict] = {}
+
+# (forbidden_domains value, compiled rules); recompiled only when the config changes
+_forbidden: tuple[str, frozenset[str]] = ("", frozenset())
+
+
+def _api(host: dict) -> tuple[str, dict]:
+    return host["api_address"].rstrip("/"), {"Authorization": host["api_secret"]}
+
+
+# request failures after which the node certainly did not clear its counters
+_NOT_CLEARED = (
+    httpx.ConnectError, httpx.ConnectTimeout, httpx.PoolTimeout,
+    httpx.UnsupportedProtocol, httpx.HTTPStatusError,
+)
+
+
+async def _poll_host(client: httpx.AsyncClient, host: dict, forbidden: frozenset[str]) -> tuple[dict, set[str], int]:
+    """
+    Returns the host's traffic counters (read and cleared in one request, and
+    journaled before anything else happens to them), the users seen reaching
+    forbidden domains, and the poll's journal id.
+    """
+    address = host["address"]
+    api_address, headers = _api(host)
+
+    offenders: dict[str, list[str]] = {}
+    if forbidden:
+        try:
+            # dumps from busy nodes run to tens of megabytes; parse them one
+            # stream at a time instead of materializing the whole document
+            async with client.stream("GET", f"{api_address}/dump/streams", headers=headers) as r:
+                if r.status_code == 200:
+                    async for stream in iter_array(r.aiter_bytes(), "streams"):
+                        addr   = stream.get("hooked_req_addr") or stream.get("req_addr", "")
+                        domain = addr.split(":")[0]
+                        if match(forbidden, domain):
+                            offenders.setdefault(stream.get("auth", ""), []).append(domain)
+                    for user, domains in offenders.items():
+                        log.event("forbidden", logging.WARNING, host=address, user=user, domains=sorted(set(domains)))
+        except Exception as e:
+            log.event("streams_error", logging.ERROR, host=address, error=str(e) or type(e).__name__)
+
+    poll_id = await journal_begin(address)
+    try:
+        r = await client.get(f"{api_address}/traffic?clear=1", headers={**headers, "X-Poll-Id": str(poll_id)})
+        r.raise_for_status()
+        traffic = r.json()
+    except BaseException as e:
+        # a request that never reached the node, or that it refused, cleared nothing;
+        # anything else may have cleared counters we never saw. Shielded so it
+        # still completes when the poll is cancelled; if it fails the entry stays
+        # pending and the next startup marks it lost.
+        lost = not isinstance(e, _NOT_CLEARED)
+        try:
+            await asyncio.shield(journal_abandon(poll_id, lost))
+        except Exception as journal_error:
+            log.event("journal_error", logging.ERROR, host=address, poll_id=poll_id,
+                      error=str(journal_error) or type(journal_error).__name__)
+        if lost:
+            log.event("poll_lost", logging.ERROR, host=address, poll_id=poll_id, error=str(e) or type(e).__name__)
+        raise
+    # the node has cleared its counters: shielded so a cancelled poll still stores them
+    if not await asyncio.shield(_journal_fetched(address, poll_id, traffic)):
+        raise RuntimeError(f"poll {poll_id} could not be journaled")
+    return traffic, set(offenders), poll_id
+
+
+async def _journal_fetched(address: str, poll_id: int, traffic: dict) -> bool:
+    """Journals a cleared poll's counters; if that fails, marks the poll lost at once."""
+    try:
+        await journal_fetched(poll_id, traffic)
+        return True
+    except Exception as e:
+        log.event("poll_lost", logging.ERROR, host=address, poll_id=poll_id, error=str(e) or type(e).__name__)
+    try:
+        await journal_abandon(poll_id, True)
+    except Exception as journal_error:
+        log.event("journal_error", logging.ERROR, host=address, poll_id=poll_id,
+                  error=str(journal_error) or type(journal_error).__name__)
+    return False
+
+
+async def _poll_host_bounded(
+    client: httpx.AsyncClient,
+    host: dict,
+    forbidden: frozenset[str],
+    limit: asyncio.Semaphore,
+    timeout: float,
+) -> tuple[dict, set[str], int] | None:
+    address = host["address"]
+    stats   = host_stats.setdefault(address, {"polls": 0, "failures": 0, "last_latency": 0.0, "last_error": ""})
+    async with limit:
+        start = time.monotonic()
+        try:
+            polled = await asyncio.wait_for(_poll_host(client, host, forbidden), timeout)
+            stats["last_error"] = ""
+            return polled
+        except asyncio.CancelledError:
+            stats["failures"]  += 1
+            stats["last_error"] = "cycle deadline exceeded"
+            metrics.poll_errors.inc(address)
+            raise
+        except Exception as e:
+            stats["failures"]  += 1
+            stats["last_error"] = str(e) or type(e).__name__
+            metrics.poll_errors.inc(address)
+            log.event("poll_error", logging.ERROR, host=address, error=stats["last_error"])
+            return None
+        finally:
+            stats["polls"]       += 1
+            stats["last_latency"] = time.monotonic() - start
+            metrics.poll_seconds.observe(stats["last_latency"], address)
+
+
+def _forbidden_rules(raw: str) -> frozenset[str]:
+    global _forbidden
+    if raw != _forbidden[0]:
+        _forbidden = (raw, compile_rules(raw))
+    return _forbidden[1]
+
+
+async def _kick_host(client: httpx.AsyncClient, host: dict, users: list[str], limit: asyncio.Semaphore, timeout: float) -> None:
+    api_address, headers = _api(host)
+    async with limit:
+        try:
+            r = await asyncio.wait_for(client.post(f"{api_address}/kick", headers=headers, json=users), timeout)
+            r.raise_for_status()
+        except Exception as e:
+            log.event("kick_error", logging.ERROR, host=host["address"], error=str(e) or type(e).__name__)
+
+
+async def _enforce(
+    client: httpx.AsyncClient,
+    hosts: list[dict],
+    seen: set[str],
+    offenders: set[str],
+    limit: asyncio.Semaphore,
+    timeout: float,
+) -> None:
+    """
+    Kicks, on every host at once, the users seen this cycle whom /auth would now
+    refuse (unknown, inactive, expired, over limit) and all forbidden-domain
+    offenders, so cut-off happens within one poll rather than on reconnect.
+    """
+    kick = await refused_users(seen)
+    for user in offenders - {""}:
+        kick.setdefault(user, "forbidden")
+    if not kick:
+        return
+    for user, reason in sorted(kick.items()):
+        log.event("kick", logging.WARNING, user=user, reason=reason)
+        metrics.kicks.inc(reason)
+    users = sorted(kick)
+    await asyncio.gather(*(_kick_host(client, host, users, limit, timeout) for host in hosts))
+
+
+async def poll_once(client: httpx.AsyncClient, hosts: list[dict] | None = None) -> dict[str, dict]:
+    """
+    Polls `hosts` (default: every active host) concurrently: at most poll_concurrency at a time, each
+    bounded by poll_host_timeout, the whole cycle by poll_cycle_deadline seconds.
+    Counters are read and cleared in one request and journaled; everything fetched
+    is committed by the ingest writer in one transaction, and polls a previous
+    cycle fetched but failed to commit are replayed first. With enforce_enable on, refused
+    users and forbidden-domain offenders are then kicked from every host.
+    Returns {address: traffic} for the hosts whose traffic was ingested.
+    """
+    forbidden     = _forbidden_rules(await get_config("forbidden_domains", ""))
+    limit         = asyncio.Semaphore(max(int(await get_config("poll_concurrency", "8")), 1))
+    timeout       = float(await get_config("poll_host_timeout", "30"))
+    deadline      = float(await get_config("poll_cycle_deadline", "120"))
+
+    recovered = await recover_journal()
+    if recovered["replayed"]:
+        log.event("journal_replayed", logging.WARNING, **recovered)
+
+    all_hosts = await list_hosts(active_only=True)
+    if hosts is None:
+        hosts = all_hosts
+    tasks = {
+        asyncio.create_task(_poll_host_bounded(client, host, forbidden, limit, timeout)): host
+        for host in hosts
+    }
+    if not tasks:
+        return {}
+    start = time.monotonic()
+    done, pending = await asyncio.wait(tasks, timeout=deadline)
+    metrics.poll_cycle.observe(time.monotonic() - start)
+    for task in pending:
+        task.cancel()
+    await asyncio.gather(*pending, return_exceptions=True)
+    if pending:
+        log.event("poll_deadline_exceeded", logging.WARNING, skipped=len(pending))
+
+    polled    = {}
+    seen      = set()
+    offenders = set()
+    for task in done:
+        result = task.result()
+        if result is not None:
+            traffic, host_offenders, poll_id = result
+            ingest.submit(tasks[task]["address"], traffic, poll_id)
+            polled[tasks[task]["address"]] = traffic
+            seen.update(traffic)
+            offenders.update(host_offenders)
+    if not polled:
+        return {}
+    try:
+        await ingest.flush()
+    except Exception as e:
+        log.event("ingest_error", logging.ERROR, error=str(e) or type(e).__name__)
+        return {}
+
+    if (await get_config("enforce_enable", "false")).lower() in ("true", "1"):
+        await _enforce(client, all_hosts, seen, offenders, limit, timeout)
+    return polled
+
+
+# ── scheduling ────────────────────────────────────────────────────────────────
+
+# upper bound (seconds) on how long the scheduler sleeps, so host and config
+# changes are picked up promptly
+_SCHEDULER_TICK = 5.0
+
+# address -> {next_due, last_polled, interval, failures}; kept by poll_hysteria
+schedule: dict[str, dict] = {}
+
+
+async def _schedule_config() -> dict:
+    lo = max(float(await get_config("poll_min_interval", "30")), 1.0)
+    return {
+        "min":          lo,
+        "max":          max(float(await get_config("poll_interval", "600")), lo),
+        "target_bytes": float(await get_config("poll_target_bytes", str(1 << 30))),
+        "jitter":       min(max(float(await get_config("poll_jitter", "0.1")), 0.0), 0.5),
+    }
+
+
+def _next_interval(entry: dict, traffic: dict | None, quota: dict[str, int], cfg: dict, now: float) -> float:
+    """
+    Picks a host's next poll interval within [poll_min_interval, poll_interval]:
+    short enough that its uncleared counters stay under poll_target_bytes and
+    that no user with a limit can overshoot their remaining quota by more than
+    one interval at the rate just observed; exponential backoff after failures.
+    """
+    if traffic is None:
+        entry["failures"] += 1
+        interval = cfg["min"] * 2 ** min(entry["failures"], 16)
+    else:
+        entry["failures"] = 0
+        interval = cfg["max"]
+        elapsed  = now - entry["last_polled"] if entry["last_polled"] else 0.0
+        if elapsed > 0:
+            used  = {u: t.get("tx", 0) + t.get("rx", 0) for u, t in traffic.items()}
+            total = sum(used.values())
+            if total:
+                interval = min(interval, cfg["target_bytes"] * elapsed / total)
+            for user, left in quota.items():
+                if used.get(user):
+                    interval = min(interval, left * elapsed / used[user])
+        else:
+            # no rate to go by yet: look again soon
+            interval = cfg["min"]
+        entry["last_polled"] = now
+    interval = min(max(interval, cfg["min"]), cfg["max"])
+    return interval * random.uniform(1 - cfg["jitter"], 1 + cfg["jitter"])
 
 
 async def poll_hysteria():
+    """
+    Polls each host on its own cadence (see _next_interval). Hosts that come
+    due together are polled as one poll_once batch; hosts, intervals and
+    jitter are re-read from the database on every tick.
+    """
+    recovered = await recover_journal(startup=True)
+    if any(recovered.values()):
+        log.event("journal_recovered", logging.WARNING, **recovered)
     async with httpx.AsyncClient(timeout=10) as client:
         while True:
-            forbidden_raw = get_config("forbidden_domains", "")
-            forbidden = [d.strip() for d in forbidden_raw.split(",") if d.strip()]
-
-            for host in list_hosts(active_only=True):
-                address     = host["address"]
-                api_address = host["api_address"].rstrip("/")
-                api_secret  = host["api_secret"]
-                headers     = {"Authorization": api_secret}
-
-                if forbidden:
-                    try:
-                        r = await client.get(f"{api_address}/dump/streams", headers=headers)
-                        if r.status_code == 200:
-                            offenders: dict[str, list[str]] = {}
-                            for stream in r.json().get("streams", []):
-                                addr   = stream.get("hooked_req_addr") or stream.get("req_addr", "")
-                                domain = addr.split(":")[0]
-                                auth   = stream.get("auth", "")
-                                for fd in forbidden:
-                                    if domain == fd or domain.endswith("." + fd):
-                                        offenders.setdefault(auth, []).append(domain)
-                            for user, domains in offenders.items():
-                                print(f"forbidden: {address} / {user}: {', '.join(sorted(set(domains)))}")
-                    except Exception as e:
-                        print(f"error streams {address}: {e}")
-
-                try:
-                    r = await client.get(f"{api_address}/traffic", headers=headers)
-                    if r.status_code == 200:
-                        ts   = datetime.now(timezone.utc).strftime("%Y-%m-%dT%H:%M:%SZ")
-                        conn = get_db()
-                        cur  = conn.cursor()
-                        for username, stats in r.json().items():
-                            tx, rx = stats.get("tx", 0), stats.get("rx", 0)
-                            if tx or rx:
-                                cur.execute(
-                                    "INSERT INTO traffic (ts, server, username, tx, rx) VALUES (?, ?, ?, ?, ?)",
-                                    (ts, address, username, tx, rx),
-                                )
-                        conn.commit()
-                        conn.close()
-                        await client.get(f"{api_address}/traffic?clear=1", headers=headers)
-                except Exception as e:
-                    print(f"error traffic {address}: {e}")
-
-            poll_interval = int(get_config("poll_interval", "600"))
-            await asyncio.sleep(poll_interval)
+            try:
+                cfg   = await _schedule_config()
+                hosts = await list_hosts(active_only=True)
+                now   = time.monotonic()
+                for address in schedule.keys() - {h["address"] for h in hosts}:
+                    del schedule[address]
+                    metrics.poll_interval.remove(address)
+
+                due = []
+                for host in hosts:
+                    entry = schedule.get(host["address"])
+                    if entry is None:
+                        # spread first polls so a restart doesn't hit every host at once
+                        entry = schedule[host["address"]] = {
+                            "next_due":    now + random.uniform(0, cfg["jitter"] * cfg["min"]),
+                            "last_polled": 0.0,
+                            "interval":    0.0,
+                            "failures":    0,
+                        }
+                    elif entry["last_polled"]:
+                        # poll_interval may have been lowered since this was scheduled
+                        entry["next_due"] = min(entry["next_due"], entry["last_polled"] + cfg["max"] * (1 + cfg["jitter"]))
+                    if entry["next_due"] <= now:
+                        due.append(host)
+
+                if due:
+                    polled = await poll_once(client, due)
+                    quota  = await remaining_quota({u for t in polled.values() for u in t})
+                    now    = time.monotonic()
+                    for host in due:
+                        entry = schedule.get(host["address"])
+                        if entry is None:
+                            continue
+                        traffic = polled.get(host["address"])
+                        entry["interval"] = _next_interval(entry, traffic, quota, cfg, now)
+                        entry["next_due"] = now + entry["interval"]
+                        metrics.poll_interval.set(host["address"], value=entry["interval"])
+
+                next_due = min((e["next_due"] for e in schedule.values()), default=now + _SCHEDULER_TICK)
+                await asyncio.sleep(min(max(next_due - time.monotonic(), 0.1), _SCHEDULER_TICK))
+            except asyncio.CancelledError:
+                raise
+            except Exception as e:
+                log.event("scheduler_error", logging.ERROR, error=str(e) or type(e).__name__)
+                await asyncio.sleep(_SCHEDULER_TICK)
+
+
+async def rollup_periodically():
+    while True:
+        try:
+            folded = await asyncio.to_thread(rollup_traffic)
+            if any(folded.values()):
+                log.event("rollup", **folded)
+        except Exception as e:
+            log.event("rollup_error", logging.ERROR, error=str(e) or type(e).__name__)
+
+        rollup_interval = int(await get_config("rollup_interval", "3600"))
+        await asyncio.sleep(rollup_interval)
+
+
+# ── leadership ────────────────────────────────────────────────────────────────
+
+_LEASE_NAME = "poller"
+_LEASE_TTL  = float(os.environ.get("HYST_LEASE_TTL", "15"))
+
+
+async def _cancel(tasks: list[asyncio.Task]) -> None:
+    for task in tasks:
+        task.cancel()
+    await asyncio.gather(*tasks, return_exceptions=True)
+
+
+async def lead() -> None:
+    """
+    Runs the poller and rollups only while this process holds the "poller"
+    lease, so every worker can start it: one polls, the others stand by and
+    take over within a lease ttl if it dies. Even a brief overlap cannot
+    double-count, since each clearing read is journaled under its own id.
+    """
+    holder = f"{socket.gethostname()}:{os.getpid()}:{secrets.token_hex(4)}"
+    tasks: list[asyncio.Task] = []
+    try:
+        while True:
+            try:
+                leader = await acquire_lease(_LEASE_NAME, holder, _LEASE_TTL)
+            except Exception as e:
+                log.event("lease_error", logging.ERROR, error=str(e) or type(e).__name__)
+                leader = False
+            if leader and not tasks:
+                log.event("leader_acquired", holder=holder)
+                tasks = [asyncio.create_task(poll_hysteria()), asyncio.create_task(rollup_periodically())]
+            elif not leader and tasks:
+                log.event("leader_lost", logging.WARNING, holder=holder)
+                await _cancel(tasks)
+                tasks = []
+            await asyncio.sleep(_LEASE_TTL / 3)
+    finally:
+        if tasks:
+            await _cancel(tasks)
+            await release_lease(_LEASE_NAME, holder)
@@ -0,0 +1,18 @@
+from fastapi import Request
+
+
+# users and hosts carry a row version; it doubles as their ETag so clients can
+# make conditional edits with If-Match
+def etag(version: int) -> str:
+    return f'"{version}"'
+
+
+def if_match(request: Request) -> int | None:
+    """The version an If-Match header asks for, None if absent; 0 (never a version) if unparseable."""
+    header = request.headers.get("if-match", "").strip()
+    if not header or header == "*":
+        return None
+    try:
+        return int(header.removeprefix("W/").strip('"'))
+    except ValueError:
+        return 0
@@ -0,0 +1,18 @@
+from fastapi import APIRouter, Query
+
+from ...database import list_changes
+
+router = APIRouter()
+
+
+@router.get("/changes")
+def changes_list(after: int = 0, limit: int = Query(1000, ge=1, le=10000)):
+    """
+    Change feed for cache layers: poll with ?after=<last id seen> and drop
+    whatever the returned (kind, key) entries name.
+    """
+    rows = list_changes(after, limit)
+    return {
+        "changes": [dict(r) for r in rows],
+        "last":    rows[-1]["id"] if rows else after,
+    }
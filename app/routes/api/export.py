@@ -0,0 +1,39 @@
+from typing import Literal, Optional
+
+from fastapi import APIRouter, Query
+from fastapi.responses import StreamingResponse
+
+from ...database import export_traffic, export_users, TRAFFIC_EXPORT_COLUMNS, USERS_EXPORT_COLUMNS
+from ...utils.export import encode, gzipped
+
+router = APIRouter()
+
+_MEDIA = {"csv": "text/csv", "ndjson": "application/x-ndjson"}
+
+
+def _stream(name: str, rows, columns: tuple[str, ...], fmt: str, gz: bool) -> StreamingResponse:
+    body     = encode(rows, columns, fmt)
+    filename = f"{name}.{fmt}"
+    if gz:
+        body, filename = gzipped(body), filename + ".gz"
+    return StreamingResponse(
+        body,
+        media_type="application/gzip" if gz else _MEDIA[fmt],
+        headers={"Content-Disposition": f'attachment; filename="{filename}"'},
+    )
+
+
+@router.get("/export/traffic")
+def export_traffic_get(
+    format: Literal["ndjson", "csv"] = "ndjson",
+    gzip: bool = False,
+    start: Optional[int] = Query(None, alias="from"),
+    end: Optional[int] = Query(None, alias="to"),
+):
+    """Every traffic row (raw and rolled up), optionally only from <= ts < to."""
+    return _stream("traffic", export_traffic(start, end), TRAFFIC_EXPORT_COLUMNS, format, gzip)
+
+
+@router.get("/export/users")
+def export_users_get(format: Literal["ndjson", "csv"] = "ndjson", gzip: bool = False):
+    return _stream("users", export_users(), USERS_EXPORT_COLUMNS, format, gzip)
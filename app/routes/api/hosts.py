@@ -1,10 +1,11 @@
 from typing import Optional
 
-from fastapi import APIRouter
+from fastapi import APIRouter, Request, Response
 from fastapi.responses import JSONResponse
 from pydantic import BaseModel
 
 from ...database import list_hosts, get_host, create_host, edit_host, delete_host, host_exists
+from . import etag, if_match
 
 router = APIRouter()
 
@@ -34,6 +35,7 @@ def _row_to_dict(row) -> dict:
         "api_address": row["api_address"],
         "api_secret":  row["api_secret"],
         "active":      bool(row["active"]),
+        "version":     row["version"],
     }
 
 
@@ -43,7 +45,7 @@ def hosts_list():
 
 
 @router.post("/hosts", status_code=201)
-def hosts_create(body: CreateBody):
+def hosts_create(body: CreateBody, response: Response):
     address = body.address.strip()
     if not address:
         return JSONResponse({"error": "address required"}, status_code=400)
@@ -57,30 +59,37 @@ def hosts_create(body: CreateBody):
     )
     if result is None:
         return JSONResponse({"error": "already exists"}, status_code=409)
+    response.headers["ETag"] = etag(result["version"])
     return result
 
 
 @router.get("/hosts/{address:path}")
-def hosts_get(address: str):
+def hosts_get(address: str, response: Response):
     row = get_host(address)
     if not row:
         return JSONResponse({"error": "not found"}, status_code=404)
+    response.headers["ETag"] = etag(row["version"])
     return _row_to_dict(row)
 
 
 @router.patch("/hosts/{address:path}")
-def hosts_edit(address: str, body: EditBody):
-    if not host_exists(address):
-        return JSONResponse({"error": "not found"}, status_code=404)
-    edit_host(
+def hosts_edit(address: str, body: EditBody, request: Request, response: Response):
+    version = if_match(request)
+    row = edit_host(
         address,
         name=body.name,
         port=body.port,
         api_address=body.api_address,
         api_secret=body.api_secret,
         active=body.active,
+        if_version=version,
     )
-    return _row_to_dict(get_host(address))
+    if row is None:
+        if version is not None and host_exists(address):
+            return JSONResponse({"error": "version mismatch"}, status_code=412)
+        return JSONResponse({"error": "not found"}, status_code=404)
+    response.headers["ETag"] = etag(row["version"])
+    return _row_to_dict(row)
 
 
 @router.delete("/hosts/{address:path}")
@@ -1,16 +1,73 @@
-from fastapi import APIRouter
-from fastapi.responses import JSONResponse
+import json
+import os
+import time
+from typing import Optional
 
-from ...database import get_traffic, user_exists
+from fastapi import APIRouter, Query
+from fastapi.responses import JSONResponse, StreamingResponse
+
+from ...database import get_traffic, traffic_series, user_exists
 
 router = APIRouter()
 
+_SERIES_MAX_ROWS = int(os.environ.get("HYST_SERIES_MAX_ROWS", "50000"))
+_STEP_UNITS      = {"s": 1, "m": 60, "h": 3600, "d": 86400}
+
+
+def _parse_step(raw: str) -> int | None:
+    """Seconds from "300", "5m", "1h", "1d"; None if malformed."""
+    raw  = raw.strip().lower()
+    unit = _STEP_UNITS.get(raw[-1:])
+    try:
+        return int(raw[:-1]) * unit if unit else int(raw)
+    except ValueError:
+        return None
+
 
 @router.get("/traffic")
 def traffic_all():
     return get_traffic()
 
 
+@router.get("/traffic/series")
+def traffic_series_get(
+    user: Optional[str] = None,
+    server: Optional[str] = None,
+    start: Optional[int] = Query(None, alias="from"),
+    end: Optional[int] = Query(None, alias="to"),
+    step: str = "1h",
+    by_server: bool = False,
+):
+    """
+    Bucketed tx/rx between epoch `from` and `to` (default: the last day),
+    optionally for one user and/or server, split per server with by_server.
+    Streamed as {"from", "to", "step", "points": [...], "truncated"}; at most
+    HYST_SERIES_MAX_ROWS points are returned.
+    """
+    step_s = _parse_step(step)
+    if step_s is None or step_s < 60:
+        return JSONResponse({"error": "step must be at least 60 seconds, e.g. 300, 5m, 1h, 1d"}, status_code=400)
+    end   = int(time.time()) if end is None else end
+    start = end - 86400 if start is None else start
+    if start >= end:
+        return JSONResponse({"error": "from must be before to"}, status_code=400)
+    if (end - start) // step_s > _SERIES_MAX_ROWS:
+        return JSONResponse({"error": f"more than {_SERIES_MAX_ROWS} buckets, use a larger step"}, status_code=400)
+
+    def body():
+        yield json.dumps({"from": start, "to": end, "step": step_s})[:-1] + ', "points": ['
+        n = 0
+        for point in traffic_series(start, end, step_s, username=user, server=server, by_server=by_server):
+            if n == _SERIES_MAX_ROWS:
+                yield '], "truncated": true}'
+                return
+            yield ("," if n else "") + json.dumps(point)
+            n += 1
+        yield '], "truncated": false}'
+
+    return StreamingResponse(body(), media_type="application/json")
+
+
 @router.get("/traffic/{username}")
 def traffic_user(username: str):
     if not user_exists(username):
@@ -1,10 +1,13 @@
-from typing import Optional
+import json
+from typing import Literal, Optional
 
-from fastapi import APIRouter
-from fastapi.responses import JSONResponse
+from fastapi import APIRouter, Query, Request, Response
+from fastapi.responses import JSONResponse, StreamingResponse
 from pydantic import BaseModel
 
-from ...database import get_user, list_users_with_traffic, create_user, edit_user, delete_user, user_exists
+from ...database import get_user, list_users_page, list_users_with_traffic, create_user, edit_user, delete_user, user_exists, bulk_users
+from ...utils import bulk
+from . import etag, if_match
 
 router = APIRouter()
 
@@ -31,49 +34,121 @@ def _row_to_dict(row) -> dict:
         "active":        bool(row["active"]),
         "traffic_limit": row["traffic_limit"],
         "expires_at":    row["expires_at"],
+        "version":       row["version"],
     }
 
 
+_USER_FIELDS = ("username", "password", "sid", "active", "traffic_limit", "expires_at", "version", "traffic_total")
+
+
 @router.get("/users")
-def users_list():
-    return [
-        {**_row_to_dict(r), "traffic_total": r["total"]}
-        for r in list_users_with_traffic()
-    ]
+def users_list(
+    request: Request,
+    response: Response,
+    after: Optional[str] = None,
+    limit: int = Query(100, ge=1, le=1000),
+    sort: Literal["username", "traffic"] = "username",
+    active: Optional[bool] = None,
+    expired: Optional[bool] = None,
+    over_limit: Optional[bool] = None,
+    near_limit: Optional[float] = Query(None, ge=0),
+    fields: Optional[str] = None,
+):
+    """
+    Users with traffic_total, as a list. Without query parameters this is every
+    user, as before. With any of them it is one page of at most `limit` users
+    and, if more follow, the cursor to pass as `after` is in X-Next-After (a
+    username, or "total:username" with sort=traffic).
+    near_limit=80 keeps users at 80% or more of their traffic_limit; fields is a
+    comma-separated subset of the user keys.
+    """
+    if not request.query_params:
+        return [
+            {**_row_to_dict(r), "traffic_total": r["total"]}
+            for r in list_users_with_traffic()
+        ]
+    keep = _USER_FIELDS
+    if fields:
+        keep = tuple(f.strip() for f in fields.split(",") if f.strip())
+        unknown = set(keep) - set(_USER_FIELDS)
+        if unknown:
+            return JSONResponse({"error": f"unknown fields: {', '.join(sorted(unknown))}"}, status_code=400)
+    try:
+        rows, next_after = list_users_page(
+            after, limit, sort=sort, active=active, expired=expired, over_limit=over_limit, near_limit=near_limit,
+        )
+    except ValueError:
+        return JSONResponse({"error": "invalid after cursor"}, status_code=400)
+    if next_after is not None:
+        response.headers["X-Next-After"] = next_after
+    users = []
+    for r in rows:
+        user = {**_row_to_dict(r), "traffic_total": r["total"]}
+        users.append({k: user[k] for k in keep})
+    return users
 
 
 @router.post("/users", status_code=201)
-def users_create(body: CreateBody):
+def users_create(body: CreateBody, response: Response):
     username = body.username.strip()
     if not username:
         return JSONResponse({"error": "username required"}, status_code=400)
     result = create_user(username, traffic_limit=body.traffic_limit, expires_at=body.expires_at)
     if result is None:
         return JSONResponse({"error": "already exists"}, status_code=409)
+    response.headers["ETag"] = etag(result["version"])
     return result
 
 
+@router.post("/users/bulk")
+async def users_bulk(request: Request, format: Optional[str] = None):
+    """
+    Creates/updates/deactivates users from a CSV, JSONL or JSON array body
+    (format from ?format= or Content-Type). Streams one NDJSON result per row
+    as each batch commits, with the generated password and sid of created users.
+    """
+    fmt = format or bulk.guess_format("", request.headers.get("content-type", ""))
+    if fmt not in ("csv", "jsonl", "json"):
+        return JSONResponse({"error": "format must be csv, jsonl or json"}, status_code=400)
+    try:
+        rows = bulk.parse(bulk.text_lines(await request.body()), fmt)
+        if fmt == "json":
+            rows = list(rows)  # surface a malformed document before streaming
+    except (UnicodeDecodeError, ValueError) as e:
+        return JSONResponse({"error": f"invalid body: {e}"}, status_code=400)
+    return StreamingResponse(
+        (json.dumps(r) + "\n" for r in bulk_users(rows)),
+        media_type="application/x-ndjson",
+    )
+
+
 @router.get("/users/{username}")
-def users_get(username: str):
+def users_get(username: str, response: Response):
     row = get_user(username)
     if not row:
         return JSONResponse({"error": "not found"}, status_code=404)
+    response.headers["ETag"] = etag(row["version"])
     return _row_to_dict(row)
 
 
 @router.patch("/users/{username}")
-def users_edit(username: str, body: EditBody):
-    if not user_exists(username):
-        return JSONResponse({"error": "not found"}, status_code=404)
-    edit_user(
+def users_edit(username: str, body: EditBody, request: Request, response: Response):
+    version = if_match(request)
+    row = edit_user(
         username,
         password=body.password,
         sid=body.sid,
         active=body.active,
         traffic_limit=body.traffic_limit,
         expires_at=body.expires_at,
+        if_version=version,
     )
-    return _row_to_dict(get_user(username))
+    if row is None:
+        if version is not None and user_exists(username):
+            return JSONResponse({"error": "version mismatch"}, status_code=412)
+        return JSONResponse({"error": "not found"}, status_code=404)
+    response.headers["ETag"] = etag(row["version"])
+    return _row_to_dict(row)
 
 
 @router.delete("/users/{username}")
@@ -1,32 +1,131 @@
+import hashlib
+import os
+import time
+from collections import OrderedDict
+
 from fastapi import APIRouter, Request
 from fastapi.responses import JSONResponse, Response
 
-from ..database import check_auth, get_config
+from .. import database, log, metrics
+from ..database import generation
+from ..database_async import check_auth, get_config
 
 router = APIRouter()
 
+# brute-force protection. Failed (username, password) pairs are remembered for
+# a while and answered without touching the database; entries are only trusted
+# at the generation they were stored at, so any user/config write (here or in
+# another process) lets a corrected account straight back in. Each failure also
+# costs its source ip a token, and an ip out of tokens is refused. The limiter
+# only sees usernames with no auth cache entry and passwords that don't match the
+# cached one: a known user giving the right password is always answered (a stale
+# entry is reloaded), so a shared (CGNAT) address drained by a scanner can't lock
+# real users out, and reconnect storms never cost tokens.
+_NEG_SIZE   = int(os.environ.get("HYST_AUTH_NEG_CACHE_SIZE", "100000"))
+_NEG_TTL    = float(os.environ.get("HYST_AUTH_NEG_TTL", "60"))
+_FAIL_RATE  = float(os.environ.get("HYST_AUTH_FAIL_RATE", "1"))    # failures/s refilled per ip, 0 = no limit
+_FAIL_BURST = float(os.environ.get("HYST_AUTH_FAIL_BURST", "20"))
+_IPS_SIZE   = int(os.environ.get("HYST_AUTH_LIMITER_IPS", "100000"))
+
+# (username, password digest) -> (reason, stored at (monotonic), generation)
+_negative: OrderedDict[tuple[str, bytes], tuple[str, float, int]] = OrderedDict()
+# ip -> [tokens, last refill (monotonic)]
+_buckets: OrderedDict[str, list] = OrderedDict()
+
+
+def _source_ip(request: Request, data: dict) -> str:
+    # hysteria calls us from the node; the client's address is in the body
+    addr = data.get("addr")
+    if isinstance(addr, str) and addr:
+        return addr.rsplit(":", 1)[0].strip("[]") if ":" in addr else addr
+    return request.client.host
+
+
+def _tokens(ip: str, now: float) -> list:
+    bucket = _buckets.get(ip)
+    if bucket is None:
+        bucket = _buckets[ip] = [_FAIL_BURST, now]
+        if len(_buckets) > _IPS_SIZE:
+            _buckets.popitem(last=False)
+        metrics.auth_tracked.set("limiter", value=len(_buckets))
+    else:
+        _buckets.move_to_end(ip)
+        bucket[0] = min(_FAIL_BURST, bucket[0] + (now - bucket[1]) * _FAIL_RATE)
+        bucket[1] = now
+    return bucket
+
+
+def _cached_failure(key: tuple[str, bytes], now: float) -> str:
+    hit = _negative.get(key)
+    if hit is None:
+        metrics.auth_negative.inc("miss")
+        return ""
+    reason, stored_at, gen = hit
+    if now - stored_at > _NEG_TTL or gen != generation():
+        del _negative[key]
+        metrics.auth_negative.inc("stale")
+        return ""
+    _negative.move_to_end(key)
+    metrics.auth_negative.inc("hit")
+    return reason
+
+
+def _remember_failure(key: tuple[str, bytes], reason: str, now: float, gen: int) -> None:
+    _negative[key] = (reason, now, gen)
+    _negative.move_to_end(key)
+    if len(_negative) > _NEG_SIZE:
+        _negative.popitem(last=False)
+    metrics.auth_tracked.set("negative", value=len(_negative))
+
 
 @router.post("/auth")
 async def auth(request: Request):
-    whitelist_enabled = get_config("whitelist_enable", "false").lower() in ("true", "1")
+    start = time.perf_counter()
+    whitelist_enabled = (await get_config("whitelist_enable", "false")).lower() in ("true", "1")
     if whitelist_enabled:
-        whitelist = set(get_config("whitelist", "").split())
+        whitelist = set((await get_config("whitelist", "")).split())
         if request.client.host not in whitelist:
+            metrics.auth_seconds.observe(time.perf_counter() - start, "forbidden")
             return Response(status_code=403)
 
     try:
         data = await request.json()
     except Exception:
+        metrics.auth_seconds.observe(time.perf_counter() - start, "malformed")
         return JSONResponse({"ok": False}, status_code=400)
 
     auth_field = data.get("auth", "")
     if ":" not in auth_field:
+        metrics.auth_seconds.observe(time.perf_counter() - start, "malformed")
         return JSONResponse({"ok": False})
 
     username, password = auth_field.split(":", 1)
-    ok, reason = check_auth(username, password)
+    now = time.monotonic()
+    ip  = _source_ip(request, data)
+    if password == database.cached_password(username):
+        # a user we've seen giving the password we hold: answered from memory, or
+        # by reloading a stale entry, and never limited
+        ok, reason = await check_auth(username, password)
+    else:
+        bucket = _tokens(ip, now) if _FAIL_RATE > 0 else None
+        if bucket is not None and bucket[0] < 1:
+            metrics.auth_limited.inc()
+            log.access("auth", user=username, result="ratelimited", ip=ip)
+            metrics.auth_seconds.observe(time.perf_counter() - start, "ratelimited")
+            return JSONResponse({"ok": False})
+        key = (username, hashlib.blake2b(password.encode(), digest_size=16).digest())
+        gen = generation()
+        if reason := _cached_failure(key, now):
+            ok = False
+        else:
+            ok, reason = await check_auth(username, password)
+            if not ok:
+                _remember_failure(key, reason, now, gen)
+        if not ok and bucket is not None:
+            bucket[0] -= 1
 
     status = "ok" if ok else reason
-    print(f"\nauth: {username} → {status} ({request.client.host})\n")
+    log.access("auth", user=username, result=status, ip=ip)
 
+    metrics.auth_seconds.observe(time.perf_counter() - start, status)
     return JSONResponse({"ok": ok, "id": username} if ok else {"ok": False})
@@ -0,0 +1,12 @@
+from fastapi import APIRouter
+from fastapi.responses import PlainTextResponse
+
+from .. import ingest, metrics
+
+router = APIRouter()
+
+
+@router.get("/metrics")
+def metrics_text():
+    metrics.ingest_queue.set(value=ingest.queue_depth())
+    return PlainTextResponse(metrics.render(), media_type="text/plain; version=0.0.4")
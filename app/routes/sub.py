@@ -1,14 +1,16 @@
 import os
 import re
+import time
 
 from fastapi import APIRouter, Request
 from fastapi.responses import Response
 from fastapi.templating import Jinja2Templates
 
-from ..database import get_db, get_traffic
+from .. import log, metrics
+from ..database_async import get_user_by_sid, get_traffic, list_hosts, get_config, generation
 from ..utils.sub import (
-    make_links, make_base_headers,
-    build_singbox, build_clash, build_plain, build_browser_ctx,
+    make_links, make_userinfo, build_browser_ctx,
+    render_subscription, cached_subscription, store_subscription,
 )
 
 router    = APIRouter()
@@ -23,44 +25,81 @@ def _get_base_url(request: Request) -> str:
     return f"{request.url.scheme}://{request.url.netloc}"
 
 
+def _etag_matches(request: Request, etag: str) -> bool:
+    header = request.headers.get("if-none-match", "")
+    return header.strip() == "*" or etag in (t.strip().removeprefix("W/") for t in header.split(","))
+
+
+async def _client_subscription(sid: str, fmt: str, base_url: str, request: Request) -> Response:
+    start    = time.perf_counter()
+    gen      = generation()
+    rendered = cached_subscription(sid, fmt, base_url, gen)
+    metrics.sub_cache.inc("miss" if rendered is None else "hit")
+    if rendered is None:
+        user = await get_user_by_sid(sid)
+        if not user:
+            return Response(status_code=404)
+        hosts            = await list_hosts(active_only=True)
+        profile_name_tpl = await get_config("profile_name_tpl", "hysteria for {uname}")
+        rendered = render_subscription(fmt, user["username"], user["password"], hosts, base_url, sid, profile_name_tpl)
+        store_subscription(sid, fmt, base_url, gen, rendered)
+
+    uname = rendered["username"]
+    log.access("sub", user=uname, format=fmt, ua=request.headers.get("user-agent", ""), ip=request.client.host)
+
+    stats   = await get_traffic(uname)
+    t       = stats[0] if stats else {}
+    headers = {
+        **rendered["headers"],
+        "subscription-userinfo": make_userinfo(t.get("day", 0), t.get("total", 0)),
+        "etag": rendered["etag"],
+    }
+    metrics.sub_seconds.observe(time.perf_counter() - start, fmt)
+    if _etag_matches(request, rendered["etag"]):
+        return Response(status_code=304, headers=headers)
+    return Response(rendered["body"], media_type=rendered["media_type"], headers=headers)
+
+
 @router.head("/sub/{sid}")
 @router.get("/sub/{sid}")
 async def subscription(sid: str, request: Request):
-    conn = get_db()
-    cur  = conn.cursor()
-    cur.execute("SELECT * FROM users WHERE sid = ?", (sid,))
-    user = cur.fetchone()
-    conn.close()
+    base_url   = _get_base_url(request)
+    ua         = request.headers.get("user-agent", "")
+    accept     = request.headers.get("accept", "")
+    is_browser = "text/html" in accept or any(k in ua for k in _BROWSER_KW)
+
+    # client documents only depend on the user, hosts and config, so they are
+    # served from the render cache; the browser page shows live traffic
+    if not is_browser:
+        if _RE_SINGBOX.search(ua):
+            fmt = "singbox"
+        elif _RE_CLASH.search(ua):
+            fmt = "clash"
+        else:
+            fmt = "plain"
+        return await _client_subscription(sid, fmt, base_url, request)
+
+    start = time.perf_counter()
+    user  = await get_user_by_sid(sid)
 
     if not user:
         return Response(status_code=404)
 
-    base_url   = _get_base_url(request)
     uname, pwd = user["username"], user["password"]
     sub_url    = f"{base_url}/sub/{sid}"
-    link_list  = make_links(uname, pwd)
-    ua         = request.headers.get("user-agent", "")
-    accept     = request.headers.get("accept", "")
-    is_browser = "text/html" in accept or any(k in ua for k in _BROWSER_KW)
+    hosts      = await list_hosts(active_only=True)
+    link_list  = make_links(uname, pwd, hosts)
 
-    stats   = get_traffic(uname)
+    stats   = await get_traffic(uname)
     t       = stats[0] if stats else {}
     hour    = t.get("hour",  0)
     day     = t.get("day",   0)
     week    = t.get("week",  0)
     alltime = t.get("total", 0)
 
-    if not is_browser:
-        print(f"\nsub: {uname} | {ua} | {request.client.host}\n")
-        title_b64, base_headers = make_base_headers(uname, day, alltime, base_url, sid)
-
-        if _RE_SINGBOX.search(ua):
-            return build_singbox(uname, pwd, base_headers)
-        if _RE_CLASH.search(ua):
-            return build_clash(uname, pwd, base_headers)
-        return build_plain(uname, pwd, title_b64, base_headers)
-
-    print(f"\nbrowser: {uname} | {request.client.host}\n")
+    log.access("sub", user=uname, format="browser", ip=request.client.host)
 
-    ctx = build_browser_ctx(uname, user["active"], sub_url, link_list, hour, day, week, alltime)
-    return templates.TemplateResponse("index.html", {"request": request, **ctx})
+    ctx      = build_browser_ctx(uname, user["active"], sub_url, link_list, hour, day, week, alltime)
+    response = templates.TemplateResponse("index.html", {"request": request, **ctx})
+    metrics.sub_seconds.observe(time.perf_counter() - start, "browser")
+    return response
@@ -0,0 +1,93 @@
+import csv
+import io
+import json
+from typing import Iterable, Iterator
+
+_OPS    = ("create", "update", "deactivate")
+_INTS   = ("traffic_limit", "expires_at")
+_TRUE   = ("1", "true", "yes")
+_FALSE  = ("0", "false", "no")
+
+
+def _bool(value) -> bool | None:
+    if value is None or value == "":
+        return None
+    if isinstance(value, bool):
+        return value
+    text = str(value).strip().lower()
+    if text in _TRUE:
+        return True
+    if text in _FALSE:
+        return False
+    raise ValueError(f"active must be true or false, got {value!r}")
+
+
+def normalize(line: int, raw) -> dict:
+    """
+    Turns one parsed record into a bulk_users row. Empty fields become None
+    (leave alone); a bad record becomes {line, username, error}.
+    """
+    if not isinstance(raw, dict):
+        return {"line": line, "username": None, "error": "expected an object"}
+    username = str(raw.get("username") or "").strip()
+    row      = {"line": line, "username": username or None}
+    try:
+        op = str(raw.get("op") or "create").strip().lower()
+        if op not in _OPS:
+            raise ValueError(f"op must be one of {', '.join(_OPS)}")
+        if not username:
+            raise ValueError("username required")
+        row["op"] = op
+        for key in ("password", "sid"):
+            row[key] = str(raw.get(key) or "").strip() or None
+        row["active"] = _bool(raw.get("active"))
+        for key in _INTS:
+            value    = raw.get(key)
+            row[key] = None if value is None or value == "" else int(value)
+    except (TypeError, ValueError) as e:
+        row["error"] = str(e)
+    return row
+
+
+def parse(lines: Iterable[str], fmt: str) -> Iterator[dict]:
+    """
+    Yields bulk_users rows from `fmt` "csv" (header line naming the columns),
+    "jsonl" (one object per line) or "json" (one array of objects), numbering
+    each by its line or array index.
+    """
+    if fmt == "csv":
+        reader = csv.DictReader(lines)
+        for raw in reader:
+            yield normalize(reader.line_num, raw)
+    elif fmt == "jsonl":
+        for n, text in enumerate(lines, 1):
+            if not text.strip():
+                continue
+            try:
+                raw = json.loads(text)
+            except json.JSONDecodeError as e:
+                yield {"line": n, "username": None, "error": f"invalid JSON: {e.msg}"}
+                continue
+            yield normalize(n, raw)
+    elif fmt == "json":
+        records = json.loads("".join(lines))
+        if not isinstance(records, list):
+            raise ValueError("expected a JSON array")
+        for n, raw in enumerate(records, 1):
+            yield normalize(n, raw)
+    else:
+        raise ValueError(f"unknown format {fmt!r}")
+
+
+def guess_format(name: str, content_type: str = "") -> str:
+    """Picks csv/jsonl/json from a file name or Content-Type, defaulting to jsonl."""
+    name, content_type = name.lower(), content_type.lower()
+    if name.endswith(".csv") or "csv" in content_type:
+        return "csv"
+    if name.endswith(".json") or content_type.startswith("application/json"):
+        return "json"
+    return "jsonl"
+
+
+def text_lines(data: bytes) -> Iterator[str]:
+    return iter(io.StringIO(data.decode("utf-8-sig"), newline=""))
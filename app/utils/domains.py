@@ -0,0 +1,23 @@
+def compile_rules(raw: str) -> frozenset[str]:
+    """
+    Compiles a comma-separated forbidden_domains value into a set of suffixes.
+    A rule "example.com" matches "example.com" and any subdomain of it.
+    """
+    return frozenset(
+        d.strip().strip(".").lower()
+        for d in raw.split(",")
+        if d.strip().strip(".")
+    )
+
+
+def match(rules: frozenset[str], domain: str) -> str | None:
+    """
+    Returns the rule that `domain` falls under, or None. Costs one set lookup
+    per label of the domain, however many rules there are.
+    """
+    domain = domain.rstrip(".").lower()
+    while domain:
+        if domain in rules:
+            return domain
+        _, _, domain = domain.partition(".")
+    return None
@@ -0,0 +1,50 @@
+import csv
+import io
+import json
+import zlib
+from typing import Iterable, Iterator
+
+_FLUSH = 64 * 1024  # bytes per yielded chunk
+
+
+def encode(rows: Iterable[tuple], columns: tuple[str, ...], fmt: str) -> Iterator[bytes]:
+    """
+    Serializes rows as "csv" (with a header line) or "ndjson" (one object per
+    line), yielding ~64 KiB chunks.
+    """
+    buf = io.StringIO()
+    if fmt == "csv":
+        out = csv.writer(buf, lineterminator="\n")
+        out.writerow(columns)
+        write = out.writerow
+    elif fmt == "ndjson":
+        def write(row):
+            buf.write(json.dumps(dict(zip(columns, row)), ensure_ascii=False))
+            buf.write("\n")
+    else:
+        raise ValueError(f"unknown format {fmt!r}")
+    for row in rows:
+        write(row)
+        if buf.tell() >= _FLUSH:
+            yield buf.getvalue().encode()
+            buf.seek(0)
+            buf.truncate()
+    if buf.tell():
+        yield buf.getvalue().encode()
+
+
+def gzipped(chunks: Iterable[bytes], level: int = 6) -> Iterator[bytes]:
+    """Compresses a byte stream into one gzip member on the fly."""
+    z = zlib.compressobj(level, zlib.DEFLATED, 31)
+    for chunk in chunks:
+        out = z.compress(chunk)
+        if out:
+            yield out
+    yield z.flush()
+
+
+def format_for(path: str) -> tuple[str, bool]:
+    """(format, gzip) for a file name like traffic.csv or users.ndjson.gz."""
+    gz   = path.endswith(".gz")
+    stem = path[:-3] if gz else path
+    return ("csv" if stem.endswith(".csv") else "ndjson"), gz
@@ -0,0 +1,48 @@
+import codecs
+import json
+import re
+from typing import AsyncIterator
+
+_decoder = json.JSONDecoder()
+_SKIP    = re.compile(r"[\s,]*")
+
+
+async def iter_array(chunks: AsyncIterator[bytes], key: str) -> AsyncIterator:
+    """
+    Yields the items of the array under top-level `key` of a JSON object as they
+    arrive, e.g. each stream of {"streams": [...]}. Only the unparsed tail of the
+    body is buffered, so memory stays flat however long the array is. Items are
+    expected to be objects or arrays (a bare number split across chunks would
+    decode early). Yields nothing if the key is absent; raises ValueError if the
+    body ends inside the array.
+    """
+    utf8     = codecs.getincrementaldecoder("utf-8")()
+    start_re = re.compile(r'"%s"\s*:\s*\[' % re.escape(key))
+    buf, pos = "", 0
+    started  = False
+
+    async for chunk in chunks:
+        buf = buf[pos:] + utf8.decode(chunk)
+        pos = 0
+        if not started:
+            m = start_re.search(buf)
+            if m is None:
+                # keep enough of the tail to find a key split across chunks
+                pos = max(len(buf) - len(key) - 64, 0)
+                continue
+            started, pos = True, m.end()
+
+        while True:
+            pos = _SKIP.match(buf, pos).end()
+            if pos >= len(buf):
+                break
+            if buf[pos] == "]":
+                return
+            try:
+                item, pos = _decoder.raw_decode(buf, pos)
+            except json.JSONDecodeError:
+                break  # item continues in the next chunk
+            yield item
+
+    if started:
+        raise ValueError(f"truncated or malformed JSON array {key!r}")
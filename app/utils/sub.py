@@ -1,20 +1,20 @@
 import os
+import time
 import base64
+import hashlib
+import string
 import urllib.parse
 import json
 
-from fastapi.responses import PlainTextResponse
 
-from ..database import list_hosts, get_config
-
-def make_links(uname: str, pwd: str) -> list[dict]:
+def make_links(uname: str, pwd: str, hosts: list[dict]) -> list[dict]:
     return [
         {
             "uri":   f"hysteria2://{uname}:{pwd}@{h['address']}:{h['port']}/?sni={h['address']}#{h['name']}",
             "label": h["name"],
             "host":  h["address"],
         }
-        for h in list_hosts(active_only=True)
+        for h in hosts
     ]
 
 
@@ -26,43 +26,129 @@ def fmt_bytes(n: int) -> str:
     return f"{n:.1f} PB"
 
 
-def make_base_headers(uname: str, day: int, alltime: int, base_url: str, sid: str) -> tuple[str, dict]:
-    profile_name_tpl = get_config("profile_name_tpl", "hysteria for {uname}")
+def make_base_headers(uname: str, base_url: str, sid: str, profile_name_tpl: str) -> tuple[str, dict]:
     profile_name = profile_name_tpl.format(uname=uname)
     title_b64    = base64.b64encode(profile_name.encode()).decode()
     headers = {
         "profile-update-interval": "12",
-        "subscription-userinfo": f"upload=0; download={day}; total={alltime}; expire=0",
         "content-disposition": f"attachment; filename*=UTF-8''{urllib.parse.quote(profile_name)}",
         "profile-web-page-url": f"{base_url}/sub/{sid}",
     }
     return title_b64, headers
 
 
-def build_singbox(uname: str, pwd: str, base_headers: dict) -> PlainTextResponse:
-    hosts = list_hosts(active_only=True)
-    config = json.load(open(os.path.join(os.path.dirname(os.path.dirname(os.path.dirname(__file__))), "templates/singbox.json")))
-    proxy_names = []
-    for h in hosts:
-        proxy_names.append(h["name"])
-        config["outbounds"].append({
-            "type": "hysteria2",
-            "tag":  h["name"],
-            "server": h["address"],
-            "server_port": h["port"],
-            "password": f"{uname}:{pwd}",
-            "tls": {"enabled": True, "server_name": h["address"]},
-        })
-    config["outbounds"][0]["outbounds"] = proxy_names
-    return PlainTextResponse(
-        json.dumps(config, indent=4, ensure_ascii=False),
-        media_type="application/json",
-        headers=base_headers,
+def make_userinfo(day: int, alltime: int) -> str:
+    return f"upload=0; download={day}; total={alltime}; expire=0"
+
+
+# ── templates ─────────────────────────────────────────────────────────────────
+
+_TEMPLATE_DIR = os.path.join(os.path.dirname(os.path.dirname(os.path.dirname(__file__))), "templates")
+
+# how often (seconds) template files are stat()ed for changes
+_TEMPLATE_CHECK_INTERVAL = 1.0
+
+# name -> {mtime, checked_at, compiled}
+_templates: dict[str, dict] = {}
+
+_SPLICE_NAMES     = "\x00proxy-names\x00"
+_SPLICE_OUTBOUNDS = "\x00outbounds\x00"
+
+
+def _compile_singbox(text: str) -> dict:
+    """
+    Turns singbox.json into a string skeleton with two splice points: the
+    selector's outbound names and the tail of the outbounds array, plus a
+    format string for one hysteria2 outbound. Rendering joins strings instead
+    of deep-copying and re-serializing the whole config; the output is
+    identical to json.dumps(config, indent=4).
+    """
+    config = json.loads(text)
+    config["outbounds"][0]["outbounds"] = _SPLICE_NAMES
+    config["outbounds"].append(_SPLICE_OUTBOUNDS)
+    skeleton = json.dumps(config, indent=4, ensure_ascii=False)
+
+    names_at = skeleton.index(json.dumps(_SPLICE_NAMES))
+    head     = skeleton[:names_at]
+    rest     = skeleton[names_at + len(json.dumps(_SPLICE_NAMES)):]
+    marker   = json.dumps(_SPLICE_OUTBOUNDS)
+    line_at  = rest.rindex("\n", 0, rest.index(marker))
+    comma_at = rest.rindex(",", 0, line_at)
+
+    names_indent    = head[head.rindex("\n") + 1:]
+    names_indent    = names_indent[:len(names_indent) - len(names_indent.lstrip())]
+    outbound_indent = rest[line_at + 1:rest.index(marker)]
+    outbound = json.dumps({
+        "type": "hysteria2",
+        "tag":  "{tag}",
+        "server": "{server}",
+        "server_port": "{port}",
+        "password": "{password}",
+        "tls": {"enabled": True, "server_name": "{server}"},
+    }, indent=4)
+    outbound = outbound.replace("{", "{{").replace("}", "}}")
+    for field in ("tag", "server", "port", "password"):
+        outbound = outbound.replace(f'"{{{{{field}}}}}"', "{" + field + "}")
+    return {
+        "head":         head,
+        "middle":       rest[:comma_at],
+        "tail":         rest[rest.index(marker) + len(marker):],
+        "names_indent": names_indent,
+        "outbound":     ",\n" + outbound_indent + outbound.replace("\n", "\n" + outbound_indent),
+    }
+
+
+def _compile_format(text: str) -> list[tuple[str, str | None]]:
+    """Splits a str.format template into (literal, field) pieces once."""
+    return [(literal, field) for literal, field, _, _ in string.Formatter().parse(text)]
+
+
+def _template(name: str, compile_fn):
+    """Returns the compiled template, recompiling it when the file's mtime changes."""
+    entry = _templates.get(name)
+    now   = time.monotonic()
+    if entry is not None and now - entry["checked_at"] < _TEMPLATE_CHECK_INTERVAL:
+        return entry["compiled"]
+
+    path  = os.path.join(_TEMPLATE_DIR, name)
+    mtime = os.stat(path).st_mtime_ns
+    if entry is None or entry["mtime"] != mtime:
+        with open(path, encoding="utf-8") as f:
+            entry = {"mtime": mtime, "compiled": compile_fn(f.read())}
+        _templates[name] = entry
+    entry["checked_at"] = now
+    return entry["compiled"]
+
+
+def load_templates() -> None:
+    """Compiles the client templates up front so the first request doesn't pay for it."""
+    _template("singbox.json", _compile_singbox)
+    _template("clash.yaml", _compile_format)
+
+
+_json_str = json.JSONEncoder(ensure_ascii=False).encode
+
+
+def build_singbox(uname: str, pwd: str, hosts: list[dict]) -> str:
+    t = _template("singbox.json", _compile_singbox)
+    if hosts:
+        inner = t["names_indent"] + "    "
+        names = "[\n" + ",\n".join(inner + json.dumps(h["name"], ensure_ascii=False) for h in hosts) + "\n" + t["names_indent"] + "]"
+    else:
+        names = "[]"
+    outbounds = "".join(
+        t["outbound"].format(
+            tag=_json_str(h["name"]),
+            server=_json_str(h["address"]),
+            port=int(h["port"]),
+            password=_json_str(f"{uname}:{pwd}"),
+        )
+        for h in hosts
     )
+    return t["head"] + names + t["middle"] + outbounds + t["tail"]
 
 
-def build_clash(uname: str, pwd: str, base_headers: dict) -> PlainTextResponse:
-    hosts = list_hosts(active_only=True)
+def build_clash(uname: str, pwd: str, hosts: list[dict]) -> str:
     proxies_yaml = "".join(
         f"  - name: {h['name']}\n"
         f"    type: hysteria2\n"
@@ -72,27 +158,77 @@ def build_clash(uname: str, pwd: str, base_headers: dict) -> PlainTextResponse:
         f"    skip-cert-verify: true\n"
         for h in hosts
     )
-    return PlainTextResponse(
-        open(os.path.join(os.path.dirname(os.path.dirname(os.path.dirname(__file__))), "templates/clash.yaml")).read().format(proxies=proxies_yaml.rstrip("\n")),
-        media_type="text/yaml",
-        headers=base_headers,
+    fields = {"proxies": proxies_yaml.rstrip("\n")}
+    return "".join(
+        literal + (fields[field] if field is not None else "")
+        for literal, field in _template("clash.yaml", _compile_format)
     )
 
 
-def build_plain(uname: str, pwd: str, title_b64: str, base_headers: dict) -> PlainTextResponse:
-    hosts = list_hosts(active_only=True)
+def build_plain(uname: str, pwd: str, hosts: list[dict]) -> str:
     body = "\n".join(
         f"hysteria2://{uname}:{pwd}@{h['address']}:{h['port']}/?sni={h['address']}#{h['name']}"
         for h in hosts
     )
-    return PlainTextResponse(
-        base64.b64encode(body.encode()).decode(),
-        headers={
-            **base_headers,
-            "profile-title": f"base64:{title_b64}",
-            "support-url": "https://t.me/wiybaa",
-        },
-    )
+    return base64.b64encode(body.encode()).decode()
+
+
+# ── render cache ──────────────────────────────────────────────────────────────
+
+# (sid, format, base_url) -> rendered document; entries are only served while
+# their generation matches the database's, i.e. no user/host/config write has
+# happened since, and for at most the cache ttl (edits made by another process)
+_RENDER_CACHE_SIZE = int(os.environ.get("HYST_SUB_CACHE_SIZE", "20000"))
+_RENDER_CACHE_TTL  = float(os.environ.get("HYST_CACHE_TTL", "60"))
+
+_render_cache: dict[tuple[str, str, str], dict] = {}
+
+
+def render_subscription(
+    fmt: str,
+    uname: str,
+    pwd: str,
+    hosts: list[dict],
+    base_url: str,
+    sid: str,
+    profile_name_tpl: str,
+) -> dict:
+    """
+    Renders a client document ("singbox", "clash" or "plain") into
+    {username, body, media_type, headers, etag}. Headers exclude
+    subscription-userinfo, which carries live traffic and is added per request.
+    """
+    title_b64, headers = make_base_headers(uname, base_url, sid, profile_name_tpl)
+    if fmt == "singbox":
+        body, media_type = build_singbox(uname, pwd, hosts), "application/json"
+    elif fmt == "clash":
+        body, media_type = build_clash(uname, pwd, hosts), "text/yaml"
+    else:
+        body, media_type = build_plain(uname, pwd, hosts), "text/plain; charset=utf-8"
+        headers["profile-title"] = f"base64:{title_b64}"
+        headers["support-url"]   = "https://t.me/wiybaa"
+    body = body.encode()
+    return {
+        "username":   uname,
+        "body":       body,
+        "media_type": media_type,
+        "headers":    headers,
+        "etag":       f'"{hashlib.blake2b(body, digest_size=12).hexdigest()}"',
+    }
+
+
+def cached_subscription(sid: str, fmt: str, base_url: str, generation: int) -> dict | None:
+    entry = _render_cache.get((sid, fmt, base_url))
+    if entry is None or entry["generation"] != generation or time.monotonic() - entry["rendered_at"] > _RENDER_CACHE_TTL:
+        return None
+    return entry
+
+
+def store_subscription(sid: str, fmt: str, base_url: str, generation: int, rendered: dict) -> None:
+    if len(_render_cache) >= _RENDER_CACHE_SIZE:
+        # dicts keep insertion order, so this drops the oldest render
+        _render_cache.pop(next(iter(_render_cache)), None)
+    _render_cache[(sid, fmt, base_url)] = {**rendered, "generation": generation, "rendered_at": time.monotonic()}
 
 
 def build_browser_ctx(
@@ -0,0 +1,68 @@
+import os
+import sqlite3
+import tempfile
+import time
+
+from app import database
+
+
+def use_db(path: str | None = None) -> str:
+    """
+    Points app.database at `path` (a fresh temp file by default) and creates the schema.
+    """
+    if path is None:
+        fd, path = tempfile.mkstemp(prefix="hyst-bench-", suffix=".db")
+        os.close(fd)
+    database._DB_PATH = path
+    database.init_db()
+    return path
+
+
+def drop_db(path: str) -> None:
+    for suffix in ("", "-wal", "-shm"):
+        if os.path.exists(path + suffix):
+            os.remove(path + suffix)
+
+
+def populate(users: int, rows: int, hosts: int = 4, days: int = 60) -> None:
+    """
+    Fills the current database with `users` users (user0..userN, password "pw")
+    and `rows` traffic rows spread evenly over the last `days` days.
+    """
+    conn = sqlite3.connect(database._DB_PATH)
+    cur  = conn.cursor()
+    cur.executemany(
+        "INSERT OR IGNORE INTO users (username, password, sid) VALUES (?, 'pw', ?)",
+        ((f"user{i}", f"sid{i}") for i in range(users)),
+    )
+    cur.executemany(
+        "INSERT OR IGNORE INTO hosts (address, name, api_address, api_secret) VALUES (?, ?, '', '')",
+        ((f"node{i}.example", f"node{i}") for i in range(hosts)),
+    )
+    span  = days * 86400
+    batch = 1_000_000
+    for start in range(0, rows, batch):
+        n = min(batch, rows - start)
+        cur.execute(f"""
+            WITH RECURSIVE seq(x) AS (SELECT {start} UNION ALL SELECT x + 1 FROM seq WHERE x < {start + n - 1})
+            INSERT INTO traffic (ts, server, username, tx, rx)
+            SELECT CAST(strftime('%s', 'now') AS INTEGER) - (x * 7919 % {span}),
+                   'node' || (x % {hosts}) || '.example',
+                   'user' || (x % {users}),
+                   abs(random() % 1000000),
+                   abs(random() % 1000000)
+            FROM seq
+        """)
+        conn.commit()
+    conn.close()
+    database.rebuild_traffic_totals()
+
+
+def rate(fn, seconds: float = 3.0) -> float:
+    """Calls `fn` repeatedly for about `seconds` and returns calls per second."""
+    n     = 0
+    start = time.perf_counter()
+    while (elapsed := time.perf_counter() - start) < seconds:
+        fn()
+        n += 1
+    return n / elapsed
@@ -0,0 +1,51 @@
+"""
+get_user / check_auth calls per second with a fresh connection per call
+(the old get_db) versus the pooled, WAL-tuned per-thread connection.
+
+    python -m bench.db --users 10000 --rows 1000000
+"""
+import argparse
+import itertools
+import sqlite3
+
+from app import database
+
+from .common import use_db, populate, rate, drop_db
+
+
+def _connect_per_call() -> sqlite3.Connection:
+    conn = sqlite3.connect(database._DB_PATH)
+    conn.row_factory = sqlite3.Row
+    return conn
+
+
+def main(users: int, rows: int, seconds: float):
+    path = use_db()
+    populate(users, rows)
+    names = itertools.cycle([f"user{i}" for i in range(users)])
+
+    # force check_auth past its in-memory cache so every call reaches sqlite
+    database._CACHE_TTL = -1
+    pooled_get_db = database.get_db
+    results = {}
+    for label, get_db in (("connect per call", _connect_per_call), ("pooled", pooled_get_db)):
+        database.get_db = get_db
+        results[label] = (
+            rate(lambda: database.get_user(next(names)), seconds),
+            rate(lambda: database.check_auth(next(names), "pw"), seconds),
+        )
+    database.get_db = pooled_get_db
+
+    print(f"{'':<18} {'get_user/s':>12} {'check_auth/s':>12}")
+    for label, (get_user, check_auth) in results.items():
+        print(f"{label:<18} {get_user:>12.0f} {check_auth:>12.0f}")
+    drop_db(path)
+
+
+if __name__ == "__main__":
+    ap = argparse.ArgumentParser()
+    ap.add_argument("--users",   type=int,   default=10_000)
+    ap.add_argument("--rows",    type=int,   default=1_000_000)
+    ap.add_argument("--seconds", type=float, default=3.0)
+    a = ap.parse_args()
+    main(a.users, a.rows, a.seconds)
@@ -0,0 +1,159 @@
+"""
+A fake hysteria traffic-stats API serving any number of nodes from one process,
+each under its own prefix: http://127.0.0.1:<port>/<node>/traffic etc.
+
+    python -m bench.fakenode --nodes 40 --users 500 --slow 2 --port 9900
+    python -m bench.fakenode --nodes 1 --streams 500000 --port 9900
+
+Each node accrues random tx/rx for `users` users on every /traffic read, so
+repeated polls always have something to ingest. Reads with ?clear=1 reset the
+counters in the same request, like hysteria, and are remembered per X-Poll-Id. --streams fills every node's
+/dump/streams with that many live streams.
+"""
+import argparse
+import asyncio
+import contextlib
+import json
+import random
+
+import uvicorn
+from fastapi import FastAPI, Request
+from fastapi.responses import JSONResponse, Response
+
+
+class FakeNode:
+    def __init__(self, users: int = 100, latency: float = 0.0, secret: str = "secret"):
+        self.users   = [f"user{i}" for i in range(users)]
+        self.latency = latency
+        self.secret  = secret
+        self.traffic: dict[str, dict] = {}
+        self.streams: list[dict]      = []
+        self.kicked:  list[str]       = []
+        self.requests = 0
+        self.accrued  = 0
+        self.cleared: dict[str, dict] = {}  # X-Poll-Id -> counters handed out
+        # fault injection for /traffic: refuse with a 500, or clear and then
+        # stall the answer for `stall` seconds
+        self.fail_rate  = 0.0
+        self.stall_rate = 0.0
+        self.stall      = 0.0
+        self._dump: bytes | None = None
+
+    def dump(self) -> bytes:
+        # encoded once: big dumps would otherwise dominate the stub's own cost
+        if self._dump is None:
+            self._dump = json.dumps({"streams": self.streams}).encode()
+        return self._dump
+
+    def accrue(self) -> None:
+        for u in self.users:
+            t = self.traffic.setdefault(u, {"tx": 0, "rx": 0})
+            tx, rx = random.randrange(1, 1_000_000), random.randrange(1, 1_000_000)
+            t["tx"] += tx
+            t["rx"] += rx
+            self.accrued += tx + rx
+
+    def fill_streams(self, count: int) -> None:
+        self.streams = [
+            {
+                "state":           "estab",
+                "auth":            random.choice(self.users),
+                "connection":      random.randrange(1 << 32),
+                "stream":          i,
+                "req_addr":        f"www.site{random.randrange(100_000)}.com:443",
+                "hooked_req_addr": "",
+                "tx":              random.randrange(1 << 24),
+                "rx":              random.randrange(1 << 28),
+                "initial_at":      "2024-01-01T00:00:00.000000000Z",
+                "last_active_at":  "2024-01-01T00:00:00.000000000Z",
+            }
+            for i in range(count)
+        ]
+        self._dump = None
+
+
+nodes: dict[str, FakeNode] = {}
+app = FastAPI()
+
+
+async def _node(name: str, request: Request) -> FakeNode | Response:
+    node = nodes.get(name)
+    if node is None:
+        return Response(status_code=404)
+    if request.headers.get("authorization", "") != node.secret:
+        return Response(status_code=401)
+    node.requests += 1
+    if node.latency:
+        await asyncio.sleep(node.latency)
+    return node
+
+
+@app.get("/{name}/traffic")
+async def traffic(name: str, request: Request, clear: str = ""):
+    node = await _node(name, request)
+    if isinstance(node, Response):
+        return node
+    if random.random() < node.fail_rate:
+        return Response(status_code=500)
+    node.accrue()
+    body = {u: dict(t) for u, t in node.traffic.items()}
+    if clear:
+        node.traffic.clear()
+        node.cleared[request.headers.get("x-poll-id", "")] = body
+        if random.random() < node.stall_rate:
+            await asyncio.sleep(node.stall)
+    return JSONResponse(body)
+
+
+@app.get("/{name}/dump/streams")
+async def streams(name: str, request: Request):
+    node = await _node(name, request)
+    if isinstance(node, Response):
+        return node
+    return Response(node.dump(), media_type="application/json")
+
+
+@app.post("/{name}/kick")
+async def kick(name: str, request: Request):
+    node = await _node(name, request)
+    if isinstance(node, Response):
+        return node
+    node.kicked.extend(await request.json())
+    return Response(status_code=200)
+
+
+def add_nodes(count: int, users: int, slow: int = 0, slow_latency: float = 15.0, latency: float = 0.05) -> list[str]:
+    names = []
+    for i in range(count):
+        name = f"n{len(nodes)}"
+        nodes[name] = FakeNode(users, slow_latency if i < slow else latency)
+        names.append(name)
+    return names
+
+
+@contextlib.asynccontextmanager
+async def serving(port: int):
+    """Runs the fake API on 127.0.0.1:`port` inside the running loop."""
+    config = uvicorn.Config(app, host="127.0.0.1", port=port, log_level="critical", timeout_graceful_shutdown=1)
+    server = uvicorn.Server(config)
+    task   = asyncio.create_task(server.serve())
+    while not server.started:
+        await asyncio.sleep(0.01)
+    try:
+        yield server
+    finally:
+        server.should_exit = True
+        await task
+
+
+if __name__ == "__main__":
+    ap = argparse.ArgumentParser()
+    ap.add_argument("--nodes", type=int,   default=40)
+    ap.add_argument("--users", type=int,   default=500)
+    ap.add_argument("--slow",  type=int,   default=2)
+    ap.add_argument("--port",  type=int,   default=9900)
+    ap.add_argument("--streams", type=int, default=0)
+    a = ap.parse_args()
+    for name in add_nodes(a.nodes, a.users, a.slow):
+        nodes[name].fill_streams(a.streams)
+    uvicorn.run(app, host="127.0.0.1", port=a.port, log_level="warning")
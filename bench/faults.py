@@ -0,0 +1,117 @@
+"""
+Fault-injection check of the poll journal: no traffic is counted twice and
+none goes missing without being flagged.
+
+    python -m bench.faults --nodes 4 --kills 30
+
+Runs the real poller (app.polling.poll_hysteria) in a child process against
+fake nodes served from this one, SIGKILLs it at random moments and restarts
+it, while the nodes randomly refuse polls or stall after clearing. A final
+child drains the journal. Every byte a node handed out on a clearing read
+must then be in the traffic table exactly once, or belong to a poll the
+journal marked lost; whatever the nodes still hold was never handed out.
+"""
+import argparse
+import asyncio
+import os
+import random
+import signal
+import sys
+
+import httpx
+
+from app import database, ingest, polling
+
+from . import fakenode
+from .common import use_db, drop_db
+
+
+async def _child(drain: bool) -> None:
+    database.init_db()
+    if not drain:
+        await polling.poll_hysteria()
+        return
+    database.recover_journal(startup=True)
+    async with httpx.AsyncClient(timeout=10) as client:
+        await polling.poll_once(client)
+    ingest.stop()
+
+
+async def _spawn(path: str, drain: bool = False) -> asyncio.subprocess.Process:
+    args = [sys.executable, "-m", "bench.faults", "--child"] + (["--drain"] if drain else [])
+    return await asyncio.create_subprocess_exec(
+        *args,
+        env={**os.environ, "HYST_DB_PATH": path},
+        stdout=asyncio.subprocess.DEVNULL,
+    )
+
+
+def _bytes(counters: dict) -> int:
+    return sum(t["tx"] + t["rx"] for t in counters.values())
+
+
+async def main(nodes: int, users: int, kills: int, port: int, seed: int):
+    rnd   = random.Random(seed)
+    path  = use_db()
+    names = fakenode.add_nodes(nodes, users, latency=0.02)
+    for name in names:
+        node = fakenode.nodes[name]
+        node.fail_rate, node.stall_rate, node.stall = 0.1, 0.1, 2.0
+        database.create_host(f"{name}.example", name, f"http://127.0.0.1:{port}/{name}", "secret")
+    for key, value in {"poll_min_interval": "1", "poll_interval": "1", "poll_jitter": "0",
+                       "poll_host_timeout": "0.5", "poll_cycle_deadline": "1"}.items():
+        database.set_config(key, value)
+
+    async with fakenode.serving(port):
+        for _ in range(kills):
+            child = await _spawn(path)
+            await asyncio.sleep(rnd.uniform(0.2, 2.0))
+            child.send_signal(signal.SIGKILL)
+            await child.wait()
+
+        for name in names:
+            fakenode.nodes[name].fail_rate = fakenode.nodes[name].stall_rate = 0.0
+        child = await _spawn(path, drain=True)
+        await child.wait()
+
+    conn     = database.get_db()
+    stored   = conn.execute("SELECT COALESCE(SUM(tx + rx), 0) FROM traffic").fetchone()[0]
+    lost_ids = {str(p["id"]) for p in database.list_lost_polls()}
+    pending  = conn.execute("SELECT COUNT(*) FROM poll_journal WHERE state != 'lost'").fetchone()[0]
+
+    handed_out = lost = on_nodes = accrued = polls = 0
+    for name in names:
+        node = fakenode.nodes[name]
+        accrued  += node.accrued
+        on_nodes += _bytes(node.traffic)
+        for poll_id, counters in node.cleared.items():
+            polls      += 1
+            handed_out += _bytes(counters)
+            if poll_id in lost_ids:
+                lost += _bytes(counters)
+
+    print(f"{kills} kills, {polls} clearing reads, {len(lost_ids)} polls flagged lost, {pending} left in journal")
+    print(f"accrued on nodes      {accrued:>16}")
+    print(f"  stored              {stored:>16}")
+    print(f"  flagged lost        {lost:>16}")
+    print(f"  still on nodes      {on_nodes:>16}")
+    ok = accrued == handed_out + on_nodes and stored == handed_out - lost and pending == 0
+    print("OK: every byte accounted for exactly once" if ok else f"MISMATCH: {stored - (handed_out - lost):+d} bytes")
+    drop_db(path)
+    return 0 if ok else 1
+
+
+if __name__ == "__main__":
+    ap = argparse.ArgumentParser()
+    ap.add_argument("--nodes", type=int, default=4)
+    ap.add_argument("--users", type=int, default=50)
+    ap.add_argument("--kills", type=int, default=30)
+    ap.add_argument("--port",  type=int, default=9902)
+    ap.add_argument("--seed",  type=int, default=1)
+    ap.add_argument("--child", action="store_true", help=argparse.SUPPRESS)
+    ap.add_argument("--drain", action="store_true", help=argparse.SUPPRESS)
+    a = ap.parse_args()
+    if a.child:
+        asyncio.run(_child(a.drain))
+    else:
+        sys.exit(asyncio.run(main(a.nodes, a.users, a.kills, a.port, a.seed)))
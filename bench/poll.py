@@ -0,0 +1,56 @@
+"""
+One poll cycle against a fleet of fake hysteria nodes.
+
+    python -m bench.poll --nodes 40 --users 500 --slow 2
+    python -m bench.poll --nodes 10 --users 500 --slow 0 --enforce 25
+
+Reports cycle wall time and per-host latency/failures from polling.host_stats.
+With --enforce N the fake users are registered, the first N of them expired,
+and enforcement switched on; the kicks each node received are reported.
+"""
+import argparse
+import asyncio
+import time
+
+import httpx
+
+from app import database, polling
+
+from . import fakenode
+from .common import use_db, drop_db
+
+
+async def main(nodes: int, users: int, slow: int, port: int, enforce: int | None):
+    path  = use_db()
+    names = fakenode.add_nodes(nodes, users, slow)
+    for name in names:
+        database.create_host(f"{name}.example", name, f"http://127.0.0.1:{port}/{name}", "secret")
+    if enforce is not None:
+        database.set_config("enforce_enable", "true")
+        for i in range(users):
+            database.create_user(f"user{i}", expires_at=1 if i < enforce else 0)
+    async with fakenode.serving(port), httpx.AsyncClient(timeout=10) as client:
+        start = time.perf_counter()
+        await polling.poll_once(client)
+        elapsed = time.perf_counter() - start
+
+    lat = sorted(s["last_latency"] for s in polling.host_stats.values())
+    failed = sum(s["failures"] for s in polling.host_stats.values())
+    print(f"cycle: {elapsed:.2f}s for {nodes} nodes ({slow} slow), {failed} failures")
+    print(f"host latency p50 {lat[len(lat) // 2]:.3f}s, max {lat[-1]:.3f}s")
+    print(f"ingested rows: {database.get_db().execute('SELECT COUNT(*) FROM traffic').fetchone()[0]}")
+    if enforce is not None:
+        kicked = [len(fakenode.nodes[name].kicked) for name in names]
+        print(f"kicked per node: min {min(kicked)}, max {max(kicked)} (expected {enforce})")
+    drop_db(path)
+
+
+if __name__ == "__main__":
+    ap = argparse.ArgumentParser()
+    ap.add_argument("--nodes", type=int, default=40)
+    ap.add_argument("--users", type=int, default=500)
+    ap.add_argument("--slow",  type=int, default=2)
+    ap.add_argument("--port",  type=int, default=9900)
+    ap.add_argument("--enforce", type=int, default=None, metavar="N")
+    a = ap.parse_args()
+    asyncio.run(main(a.nodes, a.users, a.slow, a.port, a.enforce))
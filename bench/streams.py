@@ -0,0 +1,87 @@
+"""
+Peak RSS of one /dump/streams check: the streaming parser used by the poller
+versus loading the whole body with r.json().
+
+    python -m bench.streams --streams 500000
+
+Starts bench.fakenode in a subprocess serving a dump of `streams` live streams,
+then runs each mode in a fresh interpreter so ru_maxrss is that mode's own peak.
+"""
+import argparse
+import asyncio
+import os
+import resource
+import subprocess
+import sys
+import time
+
+import httpx
+
+
+def _maxrss_mib() -> float:
+    return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024
+
+
+async def _child(mode: str, port: int) -> None:
+    from app import polling
+    from app.utils.domains import compile_rules
+
+    from .common import use_db, drop_db
+
+    path      = use_db()  # the poll journal needs a database
+    host      = {"address": "n0.example", "api_address": f"http://127.0.0.1:{port}/n0", "api_secret": "secret"}
+    forbidden = compile_rules(",".join(f"site{i}.com" for i in range(0, 100_000, 1000)))
+    base      = _maxrss_mib()
+    start     = time.perf_counter()
+    async with httpx.AsyncClient(timeout=300) as client:
+        if mode == "json":
+            r = await client.get(f"{host['api_address']}/dump/streams", headers={"Authorization": "secret"})
+            r.json()["streams"]
+        else:
+            await polling._poll_host(client, host, forbidden)
+    print(f"{mode} {time.perf_counter() - start:.2f} {_maxrss_mib() - base:.1f}")
+    drop_db(path)
+
+
+def _wait_ready(port: int, proc: subprocess.Popen) -> None:
+    while True:
+        if proc.poll() is not None:
+            raise SystemExit("fakenode exited")
+        try:
+            httpx.get(f"http://127.0.0.1:{port}/n0/traffic", headers={"Authorization": "secret"}, timeout=1)
+            return
+        except httpx.HTTPError:
+            time.sleep(0.2)
+
+
+def main(streams: int, port: int):
+    node = subprocess.Popen(
+        [sys.executable, "-m", "bench.fakenode", "--nodes", "1", "--slow", "0", "--users", "1000",
+         "--streams", str(streams), "--port", str(port)],
+        stdout=subprocess.DEVNULL,
+    )
+    try:
+        _wait_ready(port, node)
+        print(f"dump of {streams} streams")
+        print(f"{'mode':<10} {'seconds':>8} {'peak RSS MiB':>13}")
+        for mode in ("json", "stream"):
+            out = subprocess.run(
+                [sys.executable, "-m", "bench.streams", "--child", mode, "--port", str(port)],
+                capture_output=True, text=True, check=True, env={**os.environ, "HYST_LOG_LEVEL": "ERROR"},
+            ).stdout.split()
+            print(f"{out[0]:<10} {float(out[1]):>8.2f} {float(out[2]):>13.1f}")
+    finally:
+        node.terminate()
+        node.wait()
+
+
+if __name__ == "__main__":
+    ap = argparse.ArgumentParser()
+    ap.add_argument("--streams", type=int, default=500_000)
+    ap.add_argument("--port",    type=int, default=9901)
+    ap.add_argument("--child",   choices=("json", "stream"), help=argparse.SUPPRESS)
+    a = ap.parse_args()
+    if a.child:
+        asyncio.run(_child(a.child, a.port))
+    else:
+        main(a.streams, a.port)
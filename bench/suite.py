@@ -0,0 +1,169 @@
+"""
+End-to-end benchmark of the public endpoints and the poller on a synthetic
+database, for tracking regressions across releases.
+
+    python run.py bench --users 10000 --hosts 8 --rows 1000000
+    python -m bench.suite --seconds 5 --concurrency 32 --json results.json
+
+Drives /auth and /sub/{sid} in each format (singbox, clash, plain, browser)
+through the ASGI app in-process with `concurrency` clients for `seconds` each,
+then runs poll cycles against fake hysteria nodes (bench.fakenode). Reports
+throughput, p50/p99 latency and the process's peak RSS after each scenario.
+Latencies include the in-process httpx client, not a network hop.
+"""
+import argparse
+import asyncio
+import itertools
+import json
+import logging
+import platform
+import resource
+import time
+
+import httpx
+
+from app import database, ingest, log, polling
+from app.main import public_app
+
+from . import fakenode
+from .common import use_db, populate, drop_db
+
+# user agent per /sub format, see app.routes.sub
+_SUB_AGENTS = {
+    "singbox": "sing-box 1.10.0",
+    "clash":   "ClashMeta/1.18",
+    "plain":   "curl/8.5.0",
+    "browser": "Mozilla/5.0 (X11; Linux x86_64)",
+}
+
+
+def _peak_rss_mib() -> float:
+    return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024
+
+
+def _summary(name: str, latencies: list[float], elapsed: float, errors: int) -> dict:
+    latencies.sort()
+
+    def pick(q: float) -> float:
+        return latencies[min(int(q * len(latencies)), len(latencies) - 1)] * 1000 if latencies else 0.0
+
+    return {
+        "name":     name,
+        "requests": len(latencies),
+        "errors":   errors,
+        "rps":      len(latencies) / elapsed if elapsed else 0.0,
+        "p50_ms":   pick(0.50),
+        "p99_ms":   pick(0.99),
+        "rss_mib":  _peak_rss_mib(),
+    }
+
+
+async def _drive(name: str, request, users: int, seconds: float, concurrency: int) -> dict:
+    """Runs `request(client, i)` for user i in rotation from `concurrency` tasks."""
+    transport = httpx.ASGITransport(app=public_app, client=("127.0.0.1", 1))
+    ids       = itertools.cycle(range(users))
+    latencies = []
+    errors    = 0
+    async with httpx.AsyncClient(transport=transport, base_url="http://bench") as client:
+        stop = time.perf_counter() + seconds
+
+        async def worker():
+            nonlocal errors
+            while time.perf_counter() < stop:
+                start = time.perf_counter()
+                ok    = await request(client, next(ids))
+                latencies.append(time.perf_counter() - start)
+                errors += not ok
+
+        start = time.perf_counter()
+        await asyncio.gather(*(worker() for _ in range(concurrency)))
+        elapsed = time.perf_counter() - start
+    return _summary(name, latencies, elapsed, errors)
+
+
+async def _auth(client: httpx.AsyncClient, i: int) -> bool:
+    r = await client.post("/auth", json={"auth": f"user{i}:pw"})
+    return r.status_code == 200 and r.json()["ok"]
+
+
+def _sub(agent: str):
+    async def request(client: httpx.AsyncClient, i: int) -> bool:
+        r = await client.get(f"/sub/sid{i}", headers={"user-agent": agent})
+        return r.status_code == 200
+    return request
+
+
+async def _poll(hosts: int, users: int, cycles: int, port: int) -> dict:
+    """Points the generated hosts at fake nodes and times `cycles` poll cycles."""
+    names = fakenode.add_nodes(hosts, min(users, 1000), latency=0.01)
+    for i, name in enumerate(names):
+        database.edit_host(f"node{i}.example", api_address=f"http://127.0.0.1:{port}/{name}", api_secret="secret")
+    latencies = []
+    async with fakenode.serving(port), httpx.AsyncClient(timeout=30) as client:
+        start = time.perf_counter()
+        for _ in range(cycles):
+            t = time.perf_counter()
+            await polling.poll_once(client)
+            latencies.append(time.perf_counter() - t)
+        elapsed = time.perf_counter() - start
+    ingest.stop()
+    result = _summary("poll", latencies, elapsed, sum(s["failures"] for s in polling.host_stats.values()))
+    result["unit"] = "cycles"
+    return result
+
+
+def _print(results: list[dict]) -> None:
+    print(f"{'scenario':<12} {'requests':>9} {'errors':>7} {'req/s':>10} {'p50 ms':>9} {'p99 ms':>9} {'peak RSS MiB':>13}")
+    for r in results:
+        print(f"{r['name']:<12} {r['requests']:>9} {r['errors']:>7} {r['rps']:>10.1f} "
+              f"{r['p50_ms']:>9.2f} {r['p99_ms']:>9.2f} {r['rss_mib']:>13.1f}")
+
+
+async def main(users: int, hosts: int, rows: int, seconds: float, concurrency: int,
+               cycles: int, port: int, db: str | None, out: str | None) -> None:
+    log.logger.setLevel(logging.WARNING)  # access lines would swamp the report
+    path = use_db(db)
+    if db is None:
+        t = time.perf_counter()
+        populate(users, rows, hosts)
+        print(f"populated {path}: {users} users, {hosts} hosts, {rows} traffic rows in {time.perf_counter() - t:.1f}s")
+    users   = database.get_db().execute("SELECT COUNT(*) FROM users WHERE username LIKE 'user%'").fetchone()[0]
+    results = [await _drive("auth", _auth, users, seconds, concurrency)]
+    for fmt, agent in _SUB_AGENTS.items():
+        results.append(await _drive(f"sub/{fmt}", _sub(agent), users, seconds, concurrency))
+    if cycles and db is None:  # the poll scenario repoints the hosts at fake nodes
+        results.append(await _poll(hosts, users, cycles, port))
+    _print(results)
+
+    if out:
+        with open(out, "w") as f:
+            json.dump({
+                "ts":      int(time.time()),
+                "python":  platform.python_version(),
+                "sqlite":  database.sqlite3.sqlite_version,
+                "params":  {"users": users, "hosts": hosts, "rows": rows, "seconds": seconds,
+                            "concurrency": concurrency, "cycles": cycles},
+                "results": results,
+            }, f, indent=2)
+        print(f"results written to {out}")
+    if db is None:
+        drop_db(path)
+
+
+def cli(argv: list[str] | None = None) -> None:
+    ap = argparse.ArgumentParser(prog="run.py bench", description=__doc__.strip().split("\n\n")[0])
+    ap.add_argument("--users",       type=int,   default=10_000)
+    ap.add_argument("--hosts",       type=int,   default=8)
+    ap.add_argument("--rows",        type=int,   default=1_000_000, help="traffic rows to generate")
+    ap.add_argument("--seconds",     type=float, default=5.0, help="duration of each endpoint scenario")
+    ap.add_argument("--concurrency", type=int,   default=16)
+    ap.add_argument("--cycles",      type=int,   default=5, help="poll cycles to time (0 skips the poller)")
+    ap.add_argument("--port",        type=int,   default=9903, help="port for the fake hysteria nodes")
+    ap.add_argument("--db",          help="reuse a database generated earlier (skips the poller)")
+    ap.add_argument("--json",        dest="out", metavar="FILE", help="also write the results as JSON")
+    a = ap.parse_args(argv)
+    asyncio.run(main(a.users, a.hosts, a.rows, a.seconds, a.concurrency, a.cycles, a.port, a.db, a.out))
+
+
+if __name__ == "__main__":
+    cli()
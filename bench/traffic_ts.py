@@ -0,0 +1,116 @@
+"""
+Window-query timings before and after the integer-epoch traffic migration.
+
+    python -m bench.traffic_ts --rows 20000000
+
+Builds a legacy database (TEXT ts, separate ts/username indexes), times the
+hour/day/week/month query for one user and for everyone, runs init_db to
+migrate it in place, then times the same lookups against the new schema.
+"""
+import argparse
+import os
+import sqlite3
+import tempfile
+import time
+
+from app import database
+
+from .common import drop_db
+
+_LEGACY_DDL = [
+    """
+    CREATE TABLE traffic (
+        id       INTEGER PRIMARY KEY AUTOINCREMENT,
+        ts       TEXT    NOT NULL,
+        server   TEXT    NOT NULL,
+        username TEXT    NOT NULL,
+        tx       INTEGER NOT NULL,
+        rx       INTEGER NOT NULL,
+        span     INTEGER NOT NULL DEFAULT 0
+    )
+    """,
+    "CREATE INDEX traffic_ts   ON traffic (ts)",
+    "CREATE INDEX traffic_user ON traffic (username)",
+]
+
+_LEGACY_SELECT = """
+    SELECT
+        username,
+        SUM(CASE WHEN ts >= strftime('%Y-%m-%dT%H:%M:%SZ', 'now', '-60 minutes')             THEN tx + rx ELSE 0 END) AS hour,
+        SUM(CASE WHEN ts >= strftime('%Y-%m-%dT%H:%M:%SZ', 'now', 'start of day')            THEN tx + rx ELSE 0 END) AS day,
+        SUM(CASE WHEN ts >= strftime('%Y-%m-%dT%H:%M:%SZ', 'now', '-6 days', 'start of day') THEN tx + rx ELSE 0 END) AS week,
+        SUM(CASE WHEN ts >= strftime('%Y-%m-%dT%H:%M:%SZ', 'now', 'start of month')          THEN tx + rx ELSE 0 END) AS month
+    FROM traffic
+    WHERE ts >= min(strftime('%Y-%m-%dT%H:%M:%SZ', 'now', '-6 days', 'start of day'),
+                    strftime('%Y-%m-%dT%H:%M:%SZ', 'now', 'start of month'))
+"""
+
+
+def _legacy_db(path: str, users: int, rows: int, days: int) -> None:
+    conn = sqlite3.connect(path)
+    cur  = conn.cursor()
+    for ddl in _LEGACY_DDL:
+        cur.execute(ddl)
+    span  = days * 86400
+    batch = 1_000_000
+    for start in range(0, rows, batch):
+        n = min(batch, rows - start)
+        cur.execute(f"""
+            WITH RECURSIVE seq(x) AS (SELECT {start} UNION ALL SELECT x + 1 FROM seq WHERE x < {start + n - 1})
+            INSERT INTO traffic (ts, server, username, tx, rx)
+            SELECT strftime('%Y-%m-%dT%H:%M:%SZ', 'now', '-' || (x * 7919 % {span}) || ' seconds'),
+                   'node' || (x % 4) || '.example', 'user' || (x % {users}),
+                   abs(random() % 1000000), abs(random() % 1000000)
+            FROM seq
+        """)
+        conn.commit()
+    conn.close()
+
+
+def _timed(fn, repeat: int) -> float:
+    start = time.perf_counter()
+    for _ in range(repeat):
+        fn()
+    return (time.perf_counter() - start) / repeat * 1000
+
+
+def main(users: int, rows: int, days: int, repeat: int):
+    fd, path = tempfile.mkstemp(prefix="hyst-bench-", suffix=".db")
+    os.close(fd)
+    drop_db(path)
+    t = time.perf_counter()
+    _legacy_db(path, users, rows, days)
+    print(f"legacy database: {rows} rows, {users} users in {time.perf_counter() - t:.1f}s")
+
+    conn = sqlite3.connect(path)
+    one_before = _timed(lambda: conn.execute(f"{_LEGACY_SELECT} AND username = 'user1' GROUP BY username").fetchall(), repeat)
+    all_before = _timed(lambda: conn.execute(f"{_LEGACY_SELECT} GROUP BY username").fetchall(), max(repeat // 10, 1))
+    conn.close()
+
+    database._DB_PATH = path
+    t = time.perf_counter()
+    database.init_db()
+    print(f"init_db migration: {time.perf_counter() - t:.1f}s")
+
+    conn = sqlite3.connect(path)
+    sql  = database._TRAFFIC_SELECT
+    one_after = _timed(lambda: conn.execute(f"{sql} AND username = :username GROUP BY username",
+                                            {**database._traffic_windows(), "username": "user1"}).fetchall(), repeat)
+    all_after = _timed(lambda: conn.execute(f"{sql} GROUP BY username", database._traffic_windows()).fetchall(),
+                       max(repeat // 10, 1))
+    conn.close()
+
+    print(f"{'query':<14} {'before':>10} {'after':>10}")
+    print(f"{'one user':<14} {one_before:>8.2f}ms {one_after:>8.2f}ms")
+    print(f"{'all users':<14} {all_before:>8.2f}ms {all_after:>8.2f}ms")
+    drop_db(path)
+
+
+if __name__ == "__main__":
+    ap = argparse.ArgumentParser()
+    ap.add_argument("--users",  type=int, default=10_000)
+    ap.add_argument("--rows",   type=int, default=20_000_000)
+    ap.add_argument("--days",   type=int, default=60)
+    ap.add_argument("--repeat", type=int, default=50)
+    a = ap.parse_args()
+    main(a.users, a.rows, a.days, a.repeat)
@@ -1,16 +1,23 @@
 import asyncio
+import itertools
+import multiprocessing
 import sys
+from datetime import datetime, timezone
 
 import uvicorn
 
 from app.database import (
     init_db,
-    create_user, edit_user, delete_user, get_user, list_users, user_exists,
-    get_traffic,
+    create_user, edit_user, delete_user, get_user, list_users, user_exists, bulk_users,
+    get_traffic, check_traffic_totals, rebuild_traffic_totals, rollup_traffic, list_lost_polls, precopy_traffic_ts,
     create_host, edit_host, delete_host, get_host, list_hosts,
     list_config, get_config, set_config,
+    export_traffic, export_users, TRAFFIC_EXPORT_COLUMNS, USERS_EXPORT_COLUMNS,
 )
+from app.utils import bulk
+from app.utils.export import encode, gzipped, format_for
 from app.utils.sub import fmt_bytes
+from app.database_async import follow_changes
 from app.main import public_app, internal_app
 
 
@@ -43,6 +50,18 @@ def _cli_users(args: list[str]):
             print(f"{args[1]} already exists")
         return
 
+    if sub == "import" and len(args) == 2:
+        counts = {}
+        with open(args[1], encoding="utf-8-sig", newline="") as f:
+            for r in bulk_users(bulk.parse(f, bulk.guess_format(args[1]))):
+                counts[r["status"]] = counts.get(r["status"], 0) + 1
+                if r["status"] == "created":
+                    print(f"{r['line']}: {r['username']} created password={r['password']} sid={r['sid']}")
+                elif "error" in r:
+                    print(f"{r['line']}: {r['username']} {r['status']}: {r['error']}")
+        print(", ".join(f"{n} {status}" for status, n in sorted(counts.items())) or "nothing to import")
+        return
+
     if sub == "info" and len(args) == 2:
         row = get_user(args[1])
         if not row:
@@ -56,18 +75,21 @@ def _cli_users(args: list[str]):
 
     if sub == "edit" and len(args) == 2:
         username = args[1]
-        if not user_exists(username):
+        row = get_user(username)
+        if not row:
             print(f"{username} does not exist")
             return
         new_pwd    = input("password (empty to skip): ").strip() or None
         new_sid    = input("sid (empty to skip): ").strip() or None
         active_in  = input("active (empty to skip): ").strip().lower()
         new_active = True if active_in in ("1", "true") else False if active_in in ("0", "false") else None
-        edit_user(username, password=new_pwd, sid=new_sid, active=new_active)
-        if new_pwd or new_sid or new_active is not None:
+        if not (new_pwd or new_sid or new_active is not None):
+            print("nothing to update")
+            return
+        if edit_user(username, password=new_pwd, sid=new_sid, active=new_active, if_version=row["version"]):
             print("updated")
             return
-        print("nothing to update")
+        print(f"{username} was changed or deleted meanwhile, not updated")
         return
 
     if sub == "delete" and len(args) == 2:
@@ -83,6 +105,31 @@ def _cli_users(args: list[str]):
 # ── cli: traffic ─────────────────────────────────────────────────────────────
 
 def _cli_traffic(args: list[str]):
+    if args == ["--check"]:
+        rows = check_traffic_totals()
+        if not rows:
+            print("traffic totals are consistent")
+            return
+        for r in rows:
+            print(f"{r['username']}: counted tx={r['tx']} rx={r['rx']}, raw tx={r['raw_tx']} rx={r['raw_rx']}")
+        print(f"{len(rows)} mismatched, run `traffic --rebuild` to recount")
+        return
+
+    if args == ["--rebuild"]:
+        rebuild_traffic_totals()
+        print("traffic totals rebuilt")
+        return
+
+    if args == ["--lost"]:
+        polls = list_lost_polls()
+        if not polls:
+            print("no lost polls")
+            return
+        for p in polls:
+            print(f"poll {p['id']}: {p['host']} at {datetime.fromtimestamp(p['ts'], timezone.utc):%Y-%m-%d %H:%M:%S} UTC")
+        print(f"{len(polls)} polls got no answer after the node may have cleared its counters")
+        return
+
     username = args[0] if args else None
     if username and not user_exists(username):
         print(f"{username} does not exist")
@@ -113,6 +160,14 @@ def _cli_traffic(args: list[str]):
         print(line)
 
 
+# ── cli: rollup ──────────────────────────────────────────────────────────────
+
+def _cli_rollup(args: list[str]):
+    folded = rollup_traffic()
+    for level, count in folded.items():
+        print(f"{level + ':':<7} {count} rows compacted")
+
+
 # ── cli: hosts ───────────────────────────────────────────────────────────────
 
 def _cli_hosts(args: list[str]):
@@ -162,7 +217,8 @@ def _cli_hosts(args: list[str]):
 
     if sub == "edit" and len(args) == 2:
         address = args[1]
-        if not get_host(address):
+        row = get_host(address)
+        if not row:
             print(f"{address} does not exist")
             return
         new_name       = input("name (empty to skip): ").strip() or None
@@ -172,8 +228,11 @@ def _cli_hosts(args: list[str]):
         new_api_secret = input("api_secret (empty to skip): ").strip() or None
         active_in      = input("active (empty to skip): ").strip().lower()
         new_active     = True if active_in in ("1", "true") else False if active_in in ("0", "false") else None
-        edit_host(address, name=new_name, port=new_port, api_address=new_api_addr, api_secret=new_api_secret, active=new_active)
-        print("updated")
+        if edit_host(address, name=new_name, port=new_port, api_address=new_api_addr, api_secret=new_api_secret,
+                     active=new_active, if_version=row["version"]):
+            print("updated")
+            return
+        print(f"{address} was changed or deleted meanwhile, not updated")
         return
 
     if sub == "delete" and len(args) == 2:
@@ -186,6 +245,29 @@ def _cli_hosts(args: list[str]):
     print("Usage: hosts [create|info|edit|delete] <address>")
 
 
+# ── cli: export ──────────────────────────────────────────────────────────────
+
+def _cli_export(args: list[str]):
+    if len(args) < 2 or args[0] not in ("traffic", "users") or len(args) % 2:
+        print("Usage: export traffic|users <file.ndjson|file.csv>[.gz] [--from <ts>] [--to <ts>]")
+        return
+    what, path = args[0], args[1]
+    opts       = dict(zip(args[2::2], args[3::2]))
+    fmt, gz    = format_for(path)
+    if what == "traffic":
+        rows    = export_traffic(int(opts.get("--from", 0)), int(opts.get("--to", 0)) or None)
+        columns = TRAFFIC_EXPORT_COLUMNS
+    else:
+        rows    = export_users()
+        columns = USERS_EXPORT_COLUMNS
+    counter = itertools.count()
+    chunks  = encode((row for row, _ in zip(rows, counter)), columns, fmt)
+    with open(path, "wb") as f:
+        for chunk in gzipped(chunks) if gz else chunks:
+            f.write(chunk)
+    print(f"{next(counter)} {what} rows written to {path}")
+
+
 # ── cli: config ──────────────────────────────────────────────────────────────
 
 def _cli_config(args: list[str]):
@@ -213,28 +295,80 @@ def _cli_config(args: list[str]):
 # ── server ───────────────────────────────────────────────────────────────────
 
 async def _run_servers():
-    cfg_public   = uvicorn.Config(public_app,   host="127.0.0.1", port=8888, log_level="info")
+    # /auth and /sub log through app.log's queue; uvicorn's own access lines would
+    # be a synchronous stdout write on the event loop for every request
+    cfg_public   = uvicorn.Config(public_app,   host="127.0.0.1", port=8888, log_level="info", access_log=False)
     cfg_internal = uvicorn.Config(internal_app, host="127.0.0.1", port=23554, log_level="info")
     srv_public   = uvicorn.Server(cfg_public)
     srv_internal = uvicorn.Server(cfg_internal)
     await asyncio.gather(srv_public.serve(), srv_internal.serve())
 
 
+def _serve_internal():
+    asyncio.run(_internal_server())
+
+
+async def _internal_server():
+    # no public lifespan runs in this process, so follow other processes' writes here
+    follow = asyncio.create_task(follow_changes())
+    try:
+        await uvicorn.Server(uvicorn.Config(internal_app, host="127.0.0.1", port=23554, log_level="info")).serve()
+    finally:
+        follow.cancel()
+
+
+def _run_workers(workers: int):
+    """
+    Serves public_app from `workers` uvicorn worker processes and internal_app
+    from one more. Every worker runs the lifespan, but only the holder of the
+    poller lease polls; caches follow writes through the changes table.
+    Metrics are per process: /metrics on the internal app does not include the
+    workers' /auth, /sub or poller series.
+    """
+    # spawned, not forked: the parent already holds an SQLite connection from init_db
+    internal = multiprocessing.get_context("spawn").Process(target=_serve_internal, name="internal", daemon=True)
+    internal.start()
+    try:
+        uvicorn.run("app.main:public_app", host="127.0.0.1", port=8888, workers=workers, log_level="info", access_log=False)
+    finally:
+        internal.terminate()
+        internal.join()
+
+
 # ── entrypoint ───────────────────────────────────────────────────────────────
 
 if __name__ == "__main__":
     print()
-    
-    init_db()
 
     cmd  = sys.argv[1] if len(sys.argv) > 1 else ""
     args = sys.argv[2:]
 
-    if cmd == "run" and not args:
+    if cmd == "migrate" and not args:
+        # deliberately before init_db, which would run the whole migration offline
+        copied = precopy_traffic_ts()
+        if copied is None:
+            print("nothing to migrate")
+        else:
+            print(f"{copied} traffic rows copied; restart on this version to finish the migration")
+        sys.exit(0)
+
+    if cmd == "bench":
+        # before init_db: the suite works on its own temporary database
+        from bench.suite import cli
+        cli(args)
+        sys.exit(0)
+
+    init_db()
+
+    if cmd == "run" and (not args or (len(args) == 2 and args[0] == "--workers" and args[1].isdigit())):
         if not user_exists("admin"):
             print(f"created default user: admin / {create_user('admin')['password']}")
+        workers = int(args[1]) if args else 1
         try:
-            asyncio.run(_run_servers())
+            if workers > 1:
+                _run_workers(workers)
+            else:
+                asyncio.run(_run_servers())
         except KeyboardInterrupt:
             pass
         sys.exit(0)
@@ -247,6 +381,10 @@ if __name__ == "__main__":
         _cli_traffic(args)
         sys.exit(0)
 
+    if cmd == "rollup" and not args:
+        _cli_rollup(args)
+        sys.exit(0)
+
     if cmd == "hosts":
         _cli_hosts(args)
         sys.exit(0)
@@ -255,10 +393,21 @@ if __name__ == "__main__":
         _cli_config(args)
         sys.exit(0)
 
+    if cmd == "export":
+        _cli_export(args)
+        sys.exit(0)
+
     print("Usage:")
-    print("  run.py run")
+    print("  run.py run [--workers <n>]   (with --workers, /metrics only covers the internal app's")
+    print("                               own process, not the /auth, /sub and poller series)")
     print("  run.py users [create|info|edit|delete <username>]")
-    print("  run.py traffic [<username>]")
+    print("  run.py users import <file.csv|file.jsonl|file.json>")
+    print("  run.py traffic [<username>|--check|--rebuild|--lost]")
+    print("  run.py rollup")
+    print("  run.py migrate   (pre-copies a legacy traffic table while the old version serves; the")
+    print("                    first start of this version otherwise migrates offline, blocking startup)")
     print("  run.py hosts [create|info|edit|delete <address>]")
     print("  run.py config [<key> [<value>]]")
+    print("  run.py export traffic|users <file.ndjson|file.csv>[.gz] [--from <ts>] [--to <ts>]")
+    print("  run.py bench [--users <n>] [--hosts <n>] [--rows <n>] [--seconds <s>] [--json <file>] ...")
     sys.exit(1)